@@ -0,0 +1,161 @@
+# This file contains the text analysis of crawled settings, run after the crawl.
+
+import argparse
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from itertools import islice
+from loguru import logger as log
+from pymongo import UpdateOne
+from readability.exceptions import ReadabilityException
+from readability.readability import Readability
+from main import DatabaseManager, Logger
+
+# Bump when the metrics change, so older runs get analyzed again.
+ANALYSIS_VERSION = 1
+
+
+def textMetrics(text):
+    """Computes the readability and text statistics of a text.
+
+    Args:
+        text (str): The text.
+
+    Returns:
+        dict: The fields to set on the run, readability is None for texts
+        too short to score (under 100 words) or that could not be scored,
+        with the reason in analysis.error.
+    """
+    metrics = {
+        "settings.readabilityARI": None,
+        "settings.readabilityFLESH": None,
+        "analysis.stats": None,
+        "analysis.error": None,
+    }
+    try:
+        r = Readability(text or "")
+        metrics["analysis.stats"] = r.statistics()
+        metrics["settings.readabilityARI"] = r.ari().__dict__
+        metrics["settings.readabilityFLESH"] = r.flesch().__dict__
+    except ReadabilityException as e:
+        metrics["analysis.error"] = str(e)
+    except Exception as e:
+        # Keep one bad text from failing the whole batch.
+        metrics["analysis.error"] = "{}: {}".format(type(e).__name__, e)
+    return metrics
+
+
+def analyzeBatch(runs):
+    """Computes the metrics of a batch of runs, in a worker process.
+
+    Args:
+        runs (list): (run id, settings text) pairs.
+
+    Returns:
+        list: (run id, fields to set) pairs.
+    """
+    return [(runId, textMetrics(text)) for runId, text in runs]
+
+
+def readBatches(cursor, size):
+    """Groups the runs of a cursor into lists of (run id, settings text)."""
+    pairs = ((run["_id"], run["settings"].get("text")) for run in cursor)
+    while True:
+        batch = list(islice(pairs, size))
+        if not batch:
+            return
+        yield batch
+
+
+def writeMetrics(db: DatabaseManager, results):
+    """Writes the metrics of a batch of runs, in one bulk write.
+
+    Args:
+        db (DatabaseManager): The database.
+        results (list): (run id, fields to set) pairs, from analyzeBatch.
+
+    Returns:
+        int: The amount of runs written.
+    """
+    now = datetime.utcnow()
+    ops = [
+        UpdateOne(
+            {"_id": runId},
+            {
+                "$set": dict(
+                    metrics,
+                    **{"analysis.version": ANALYSIS_VERSION, "analysis.at": now}
+                )
+            },
+        )
+        for runId, metrics in results
+    ]
+    try:
+        db.runs.bulk_write(ops, ordered=False)
+    except Exception as e:
+        log.exception(e)
+        return 0
+    log.debug("Wrote metrics of {} runs.", len(ops))
+    return len(ops)
+
+
+def analyzeRuns(db: DatabaseManager, workers=None, batchSize=200, force=False):
+    """Computes text metrics for the finished runs of a campaign, or all
+    campaigns if the db has none, and writes them back in bulk. Runs already
+    analyzed by this ANALYSIS_VERSION are skipped, unless forced.
+
+    Args:
+        db (DatabaseManager): The database.
+        workers (int, optional): Worker processes. Defaults to the amount of cpus.
+        batchSize (int, optional): Runs per batch and bulk write. Defaults to 200.
+        force (bool, optional): Analyze runs that already are. Defaults to False.
+
+    Returns:
+        int: The amount of runs analyzed.
+    """
+    query = {"status": "runDone", "settings.text": {"$type": "string"}}
+    if db.campaign:
+        query["campaign"] = db.campaign
+    if not force:
+        query["analysis.version"] = {"$ne": ANALYSIS_VERSION}
+    cursor = db.runs.find(query, {"settings.text": 1})
+    workers = workers or os.cpu_count()
+    done = 0
+    with ProcessPoolExecutor(workers) as pool:
+        # Executor.map would read the whole cursor up front, keep a few
+        # batches in flight instead.
+        pending = deque()
+        for batch in readBatches(cursor, batchSize):
+            pending.append(pool.submit(analyzeBatch, batch))
+            if len(pending) >= 2 * workers:
+                done += writeMetrics(db, pending.popleft().result())
+        while pending:
+            done += writeMetrics(db, pending.popleft().result())
+    log.info("Analyzed {} runs.", done)
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Computes text metrics for crawled runs."
+    )
+    parser.add_argument(
+        "--campaign", default=None, help="Only analyze runs of this campaign."
+    )
+    parser.add_argument(
+        "--workers", type=int, default=None, help="Amount of worker processes."
+    )
+    parser.add_argument(
+        "--batch-size", type=int, default=200, help="Runs per batch and bulk write."
+    )
+    parser.add_argument(
+        "--force", action="store_true", help="Analyze runs again, also done ones."
+    )
+    args = parser.parse_args()
+    Logger(log)
+    db = DatabaseManager(campaign=args.campaign)
+    try:
+        analyzeRuns(db, args.workers, args.batch_size, args.force)
+    finally:
+        db.close()
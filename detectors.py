@@ -3,10 +3,193 @@
 import splinter
 import selenium
 import json
+import os
+import pickle
+import re
 from abp.filters import parse_filterlist
 from abp.filters.parser import Filter
+from urllib.parse import urlsplit
 from loguru import logger as log
 
+RULE_CACHE_VERSION = 1
+
+
+class RuleIndex:
+    """A precompiled index of the element hiding rules in a filter list.
+
+    The filter list is parsed once into a list of generic selectors, which
+    applies to every site, and a domain map, which holds the site specific
+    selectors and the exceptions (#@# rules and ~domain options) per domain.
+    Looking up the rules for a url then only costs one dict probe per
+    suffix of its hostname.
+    """
+
+    def __init__(self):
+        self.checksum = None  # The "! Checksum:" header of the list.
+        self.generic = []  # Selectors applicable everywhere.
+        self.specific = {}  # Domain -> list of site specific selectors.
+        self.exceptions = {}  # Domain -> set of selectors not to apply.
+
+    @classmethod
+    def from_filterlist(cls, lines):
+        """Builds a index from the lines of a filter list.
+
+        Args:
+            lines (iterable): The lines of the filter list.
+
+        Returns:
+            RuleIndex: The compiled index.
+        """
+        index = cls()
+        for rule in parse_filterlist(lines):
+            if rule.type == "metadata" and rule.key == "Checksum":
+                index.checksum = rule.value
+                continue
+            if not isinstance(rule, Filter) or rule.selector.get("type") != "css":
+                continue
+            selector = rule.selector.get("value")
+            domains = []
+            for key, value in rule.options:
+                if key == "domain":
+                    domains = value
+            included = [domain for domain, applicable in domains if applicable]
+            excluded = [domain for domain, applicable in domains if not applicable]
+            if rule.action == "show":
+                # Exception rule (#@#), the selector should not be used here.
+                for domain in included:
+                    index.exceptions.setdefault(domain, set()).add(selector)
+                continue
+            if included:
+                for domain in included:
+                    index.specific.setdefault(domain, []).append(selector)
+            else:
+                index.generic.append(selector)
+            for domain in excluded:
+                index.exceptions.setdefault(domain, set()).add(selector)
+        return index
+
+    @classmethod
+    def from_file(cls, path):
+        with open(path) as filterlist:
+            return cls.from_filterlist(filterlist)
+
+    @classmethod
+    def load(cls, path, cache_path=None):
+        """Loads the index for a filter list, using a compiled cache file.
+
+        The cache is keyed on the checksum header and mtime of the list and is
+        only rebuilt when the list has changed.
+
+        Args:
+            path (str): Path to the filter list.
+            cache_path (str, optional): Path to the cache. Defaults to path + ".cache".
+
+        Returns:
+            RuleIndex: The compiled index.
+        """
+        cache_path = cache_path or path + ".cache"
+        key = (RULE_CACHE_VERSION, read_checksum(path), os.stat(path).st_mtime_ns)
+        try:
+            with open(cache_path, "rb") as cache:
+                if pickle.load(cache) == key:
+                    index = cls()
+                    index.__dict__.update(pickle.load(cache))
+                    return index
+            log.debug("Rule cache {} is stale.", cache_path)
+        except FileNotFoundError:
+            log.debug("No rule cache found at {}.", cache_path)
+        except Exception as e:
+            log.warning("Could not read rule cache {}: {}", cache_path, e)
+        index = cls.from_file(path)
+        try:
+            # Write to a temp file first so other processes never read half a cache.
+            tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+            with open(tmp_path, "wb") as cache:
+                pickle.dump(key, cache, pickle.HIGHEST_PROTOCOL)
+                pickle.dump(index.__dict__, cache, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            log.warning("Could not write rule cache {}: {}", cache_path, e)
+        return index
+
+    def lookup(self, url):
+        """Looks up the site specific part of the rules for a url.
+
+        Args:
+            url (str): The url to check. In format https://url or url.
+
+        Returns:
+            tuple: The site specific selectors (list) and the selectors that
+            are excepted on the site (set).
+        """
+        specific = []
+        exceptions = set()
+        for domain in domain_suffixes(url):
+            specific.extend(self.specific.get(domain, ()))
+            exceptions.update(self.exceptions.get(domain, ()))
+        return specific, exceptions
+
+    def rules_for_url(self, url):
+        """Gets all the rules appliciable to a url.
+
+        Args:
+            url (str): The url to check. In format https://url or url.
+
+        Returns:
+            [list]: The list of appliciable rules.
+        """
+        specific, exceptions = self.lookup(url)
+        if not exceptions:
+            return self.generic + specific
+        return [rule for rule in self.generic + specific if rule not in exceptions]
+
+
+def read_checksum(path):
+    """Reads the "! Checksum:" header of a filter list.
+
+    Args:
+        path (str): Path to the filter list.
+
+    Returns:
+        str: The checksum, or None if the list has none.
+    """
+    with open(path) as filterlist:
+        for line in filterlist:
+            if not line.startswith(("!", "[")):
+                # The header is over.
+                break
+            if line.startswith("! Checksum:"):
+                return line.split(":", 1)[1].strip()
+    return None
+
+
+def domain_suffixes(url):
+    """Returns the hostname of a url and all its parent domains.
+
+    Args:
+        url (str): The url. In format https://url or url.
+
+    Returns:
+        [list]: The domains, e.g. ["www.example.com", "example.com", "com"].
+    """
+    if "://" not in url:
+        url = "//" + url
+    hostname = urlsplit(url).hostname or ""
+    labels = hostname.split(".")
+    return [".".join(labels[i:]) for i in range(len(labels)) if labels[i]]
+
+
+_rule_index = None
+
+
+def get_rule_index(path="list.txt"):
+    """Returns the compiled rule index, the list is only loaded on first use."""
+    global _rule_index
+    if _rule_index is None:
+        log.debug("Loading filter list {}.", path)
+        _rule_index = RuleIndex.load(path)
+    return _rule_index
+
 
 def get_rules_for_url(url):
     """This function gets all the adblock rules appliciable to a specific domain.
@@ -17,40 +200,7 @@ def get_rules_for_url(url):
     Returns:
         [list]: The list of appliciable rules.
     """
-    # Make sure we do not have https/http with the url.
-    url = url.replace("https://", "")
-    url = url.replace("http://", "")
-    url = url.replace("/", "")
-    css_rules = []
-    with open("list.txt") as filterlist:
-        rules = parse_filterlist(filterlist)
-        rules = [rule for rule in rules if isinstance(rule, Filter)]
-        for rule in rules:
-            if rule.selector.get("type") == "css":
-                # Check if there is a specific domain for the specific rule.
-                options = [
-                    (key, value) for key, value in rule.options if key == "domain"
-                ]
-                # If not, its appliciable everywhere, add it to list.
-                if len(options) == 0:
-                    css_rules.append(rule.selector.get("value"))
-                    continue
-                # there is only one domain option, if applicable then add rule.
-                _, domains = options[0]
-                domains = [
-                    (domain, applicable)
-                    for domain, applicable in domains
-                    if applicable == True
-                ]
-                if len(domains) == 0:
-                    css_rules.append(rule.selector.get("value"))
-                    continue
-                # Loop through the domains, if domain is matched, add rule.
-                for domain_opts, _ in domains:
-                    if domain_opts in url:
-                        css_rules.append(rule.selector.get("value"))
-
-    return css_rules
+    return get_rule_index().rules_for_url(url)
 
 
 def find_by_cookie_string(browser: splinter.driver.DriverAPI):
@@ -69,88 +219,168 @@ def find_by_cookie_string(browser: splinter.driver.DriverAPI):
 
 
 ### FIXED WIDTH ###
+# Walks up from a element until it finds one with a fixed position.
+FIXED_PARENT_FN = """
+    function findFixedParent(elem) {
+        // While we have a element and parent is not whole html document.
+        while (elem && elem.parentElement && elem.parentElement.tagName !== "HTML") {
+            if (getComputedStyle(elem).position === "fixed") {
+                return elem;
+            }
+            elem = elem.parentElement;
+        }
+        return null;
+    }"""
+
+
 def find_by_fixed_parent(browser, elems):
     found = []
     for elem in elems:
         f_elem = find_by_fixed_helper(browser, elem)
-        if f_elem and f_elem._element.is_displayed():
+        if f_elem and f_elem.is_displayed():
             found.append(f_elem)
     if len(found) > 0:
-        return found[0]._element
+        return found[0]
     return None
 
 
-def get_parent(browser, elem):
-    parent = elem.find_by_xpath("./..").first
-    if parent:
-        return parent
-    return None
+def find_by_fixed_helper(browser, elem):
+    """Finds the closest fixed position ancestor (or self) of a element, in page.
 
+    Args:
+        browser (splinter.driver.DriverAPI): The browser.
+        elem (splinter.driver.ElementAPI): The element to start at.
 
-def find_by_fixed_helper(browser, elem):
-    s_elem = elem
-    # While we have a element and parent is not whole html document.
-    while s_elem and get_parent(browser, s_elem).tag_name != "html":
-        if s_elem._element.value_of_css_property("position") == "fixed":
-            return s_elem
-        s_elem = get_parent(browser, s_elem)
-    return None
+    Returns:
+        WebElement: The fixed element, if any.
+    """
+    script = FIXED_PARENT_FN + "return findFixedParent(arguments[0]);"
+    return browser.execute_script(script, elem._element)
 
 
 ### FIND BY RULES ###
+# Matches the rules in page and returns the visible, non-empty elements. The
+# generic rules are read from window.__ccrawlerGeneric, which is installed
+# once per session by install_generic_rules, unless passed in arguments[2].
+# Returns null if the generic rules are not available in the document.
+MATCH_RULES_FN = """
+    function matchRules(specific, excepted, generic) {
+        if (!generic) {
+            generic = window.__ccrawlerGeneric;
+            if (!generic) return null;
+        }
+        // Drop selectors the browser can not parse, they would break the query.
+        if (generic !== window.__ccrawlerValid) {
+            const probe = document.createDocumentFragment();
+            window.__ccrawlerValid = generic;
+            window.__ccrawlerValidRules = generic.filter(rule => {
+                try {
+                    probe.querySelector(rule);
+                    return true;
+                } catch (e) {
+                    return false;
+                }
+            });
+        }
+        let rules = window.__ccrawlerValidRules;
+        if (excepted.length > 0) {
+            const skip = new Set(excepted);
+            rules = rules.filter(rule => !skip.has(rule));
+        }
+        const found = [];
+        const seen = new Set();
+        function addMatches(selector) {
+            let elems;
+            try {
+                elems = document.querySelectorAll(selector);
+            } catch (e) {
+                return;
+            }
+            elems.forEach(elem => {
+                if (seen.has(elem)) return;
+                seen.add(elem);
+                const visible = elem.offsetWidth || elem.offsetHeight || elem.getClientRects().length;
+                if (visible && (elem.innerText || "").trim()) {
+                    found.push(elem);
+                }
+            });
+        }
+        if (rules.length > 0) addMatches(rules.join(","));
+        specific.filter(rule => !excepted.includes(rule)).forEach(addMatches);
+        return found;
+    }"""
+MATCH_RULES_JS = (
+    MATCH_RULES_FN + "return matchRules(arguments[0], arguments[1], arguments[2]);"
+)
+
+# Sessions that already have the generic rules installed.
+_installed_sessions = set()
+
+
+def install_generic_rules(browser: splinter.driver.DriverAPI):
+    """Installs the generic rules in the browser session, so that every new
+    document gets them without sending them over WebDriver for each page.
+
+    Args:
+        browser (splinter.driver.DriverAPI): The browser to install in.
+
+    Returns:
+        bool: If the rules were installed.
+    """
+    session_id = browser.driver.session_id
+    if session_id in _installed_sessions:
+        return True
+    try:
+        browser.driver.execute_cdp_cmd(
+            "Page.addScriptToEvaluateOnNewDocument",
+            {
+                "source": "window.__ccrawlerGeneric = {};".format(
+                    json.dumps(get_rule_index().generic)
+                )
+            },
+        )
+        _installed_sessions.add(session_id)
+        log.debug("Installed generic rules in session.")
+        return True
+    except Exception as e:
+        log.warning("Could not install generic rules: {}", e)
+        return False
+
+
 def find_by_list(browser):
     found = find_by_ruleset(browser)
-    if len(found) > 0 and found[0]._element.is_displayed():
+    if len(found) > 0 and found[0].is_displayed():
         log.debug(found[0])
-        return found[0]._element
+        return found[0]
     return None
 
 
 def find_by_ruleset(browser: splinter.driver.DriverAPI):
-    # Get applicable rules for the current url.
-    found_elems = []
-    log.warning(browser.url)
-    rules = get_rules_for_url(browser.url)
-    # Check if we have any css match, if so save down the match string.
-    found_rules = browser.execute_script(
-        """
-        function getElems(rules){
-            return found=[],
-            rules.forEach(e=>{
-                elems=document.querySelectorAll(e)
-                if(elems.length > 0){
-                    found.push(e)
-                }
-                }),
-                found}
-        return getElems(arguments[0])
-     """,
-        rules,
-    )
-    log.debug(found_rules)
-    # Now lets find elements containing something...
-    for rule in found_rules:
-        log.debug("Checking for {}", rule)
-        found_matchs = browser.find_by_css(rule)
-        for elem in found_matchs:
-            if elem.text:
-                found_elems.append(elem)
-    # Lets find all element on page containing these matches.
-    # Turn them into local webdriver elements :)
-    # local_elems = []
-    # for elem in elements:
-    #    local_elems.append(
-    #        selenium.webdriver.remote.webdriver.WebElement(
-    #            elem._parent, elem._id, elem._w3c
-    #        )
-    #    )
+    """Finds the visible, non-empty elements matching the adblock rules.
+
+    Args:
+        browser (splinter.driver.DriverAPI): The browser to look in.
+
+    Returns:
+        [list]: The matching WebElements, in document order.
+    """
+    # Get the site specific part of the rules, the generic part is in page.
+    specific, excepted = get_rule_index().lookup(browser.url)
+    excepted = list(excepted)
+    found_elems = browser.execute_script(MATCH_RULES_JS, specific, excepted)
+    if found_elems is None:
+        # Document was loaded before the rules were installed, send them along.
+        log.debug("Generic rules not installed in page, sending them.")
+        found_elems = browser.execute_script(
+            MATCH_RULES_JS, specific, excepted, get_rule_index().generic
+        )
+    log.debug("Found {} elements by rules.", len(found_elems))
     return found_elems
 
 
 ### FULL WIDTH ###
 # The JavaScript code is from a github project, link here before release of thesis.
-def find_by_full_helper(browser, elem):
-    script = """
+FULL_WIDTH_FN = """
             function findFullWidthParent(elem) {
                 function parseValue(value) {
                     var parsedValue = parseInt(value);
@@ -225,8 +455,11 @@ def find_by_full_helper(browser, elem):
                 } else {
                     return false;
                 }
-            }
-            return findFullWidthParent(arguments[0]);"""
+            }"""
+
+
+def find_by_full_helper(browser, elem):
+    script = FULL_WIDTH_FN + "return findFullWidthParent(arguments[0]);"
     elem = browser.driver.execute_script(script, elem._element)
     if elem:
         elem = selenium.webdriver.remote.webelement.WebElement(elem._parent, elem._id)
@@ -258,73 +491,502 @@ trigsAppr = [
 ]
 trigsSettings = ["save", "continue", "spara"]
 
+# Walks up from a button until it finds a div, wider than the button, with flex
+# in its computed style and returns the parent of that div.
+BTN_PARENT_FN = """
+    function findBtnParent(btn) {
+        const btnWidth = btn.getBoundingClientRect().width;
+        let elem = btn;
+        // While we have a element and parent is not whole html document.
+        while (elem && elem.parentElement && elem.parentElement.tagName !== "HTML") {
+            const rect = elem.getBoundingClientRect();
+            // Same check as before, on the property names of the computed style.
+            const props = Array.prototype.join.call(getComputedStyle(elem), "");
+            if (
+                elem.tagName === "DIV" &&
+                rect.height > 10 &&
+                rect.width > btnWidth * 2 + 50 &&
+                props.includes("flex")
+            ) {
+                return elem.parentElement;
+            }
+            elem = elem.parentElement;
+        }
+        return null;
+    }"""
+
+
+# Trigger lists for the buttons of notices and settings, by category.
+BUTTON_TRIGGERS = {
+    "approve": [
+        "approve",
+        "okay",
+        "accept",
+        "agree",
+        "allow",
+        "continue",
+        "godkänn",
+        "förstår",
+        "stäng",
+    ],
+    "more": [
+        "configure",
+        "manage",
+        "settings",
+        "customize",
+        "customise",
+        "change",
+        "inställningar",
+        "more",
+        "mer",
+        "neka",
+    ],
+    "denyAll": ["denyall", "alldeny", "rejectall", "nekaalla", "allaneka"],
+    "acceptAll": [
+        "approveall",
+        "allenable",
+        "acceptall",
+        "enableall",
+        "tillåtalla",
+        "godkännalla",
+    ],
+    "settings": trigsSettings,
+}
+
+# Gathers the rendered buttons, inputs and links under a root (or the
+# document) with their text made lowercase and stripped of everything but
+# letters.
+BUTTON_CANDIDATES_JS = """
+    function buttonCandidates(root) {
+        root = root || document;
+        const found = [];
+        for (const tag of ["button", "input", "a"]) {
+            for (const elem of root.getElementsByTagName(tag)) {
+                // Not rendered, like the text WebDriver gives for it.
+                if (!elem.getClientRects().length) continue;
+                const text = (elem.innerText || elem.value || "")
+                    .toLowerCase()
+                    .replace(/[^\\p{L}]/gu, "");
+                if (text) found.push([elem, text]);
+            }
+        }
+        return found;
+    }
+    return buttonCandidates(arguments[0]);
+"""
+
+
+class ButtonMatcher:
+    """Matches button texts against several trigger lists in one pass."""
+
+    def __init__(self, triggers):
+        """Init class for ButtonMatcher
+
+        Args:
+            triggers (dict): Category -> list of strings to look for.
+        """
+        self.patterns = {
+            category: re.compile("|".join(re.escape(trig) for trig in trigs))
+            for category, trigs in triggers.items()
+        }
+
+    def match(self, candidates):
+        """Finds the first candidate for each category.
+
+        Args:
+            candidates (list): Pairs of element and normalized text.
+
+        Returns:
+            dict: Category -> the found element, or None.
+        """
+        hits = dict.fromkeys(self.patterns)
+        left = dict(self.patterns)
+        for elem, text in candidates:
+            for category, pattern in list(left.items()):
+                if pattern.search(text):
+                    hits[category] = elem
+                    del left[category]
+            if not left:
+                break
+        return hits
+
+
+_matchers = {}
+
+
+def match_buttons(root, triggers):
+    """Finds the buttons matching each trigger list, with a single call to page.
+
+    Args:
+        root: A splinter browser to look in the whole page, or a WebElement
+            to look within that element.
+        triggers (dict): Category -> list of strings to look for.
+
+    Returns:
+        dict: Category -> the found WebElement, or None.
+    """
+    key = tuple((category, tuple(trigs)) for category, trigs in triggers.items())
+    if key not in _matchers:
+        _matchers[key] = ButtonMatcher(triggers)
+    try:
+        if isinstance(root, selenium.webdriver.remote.webelement.WebElement):
+            candidates = root.parent.execute_script(BUTTON_CANDIDATES_JS, root)
+        else:
+            candidates = root.execute_script(BUTTON_CANDIDATES_JS, None)
+    except Exception as e:
+        log.exception(e)
+        return dict.fromkeys(triggers)
+    hits = _matchers[key].match(candidates)
+    log.debug(
+        "Matched buttons {} of {} candidates.",
+        [category for category, elem in hits.items() if elem],
+        len(candidates),
+    )
+    return hits
+
+
+### ELEMENT SNAPSHOT ###
+# Collects everything Button, Consent and ConsentSettings need to know about a
+# element and its subtree.
+SNAPSHOT_JS = """
+    function snapshotElement(elem) {
+        function href(elem) {
+            return typeof elem.href === "string" ? elem.href : elem.getAttribute("href");
+        }
+        const style = getComputedStyle(elem);
+        const rect = elem.getBoundingClientRect();
+        return {
+            text: (elem.innerText || "").trim(),
+            value: elem.getAttribute("value"),
+            tagName: elem.tagName.toLowerCase(),
+            html: elem.outerHTML,
+            size: {height: rect.height, width: rect.width},
+            href: href(elem) || null,
+            backgroundColor: style.backgroundColor,
+            color: style.color,
+            links: Array.from(elem.getElementsByTagName("a")).map(href),
+            totalCheckboxes: elem.querySelectorAll("input[type='checkbox']").length,
+            checkedCheckboxes: elem.querySelectorAll("input[type='checkbox']:checked").length,
+        };
+    }
+    return snapshotElement(arguments[0]);
+"""
+
+
+def snapshot_element(elem):
+    """Takes a snapshot of a element and its subtree, in one call to page.
+
+    Args:
+        elem (WebElement): The element.
+
+    Returns:
+        dict: The text, value, tagName, html, size, href, backgroundColor,
+        color, links, totalCheckboxes and checkedCheckboxes of the element.
+    """
+    return elem.parent.execute_script(SNAPSHOT_JS, elem)
+
 
 def _findBtnElem(browser, triggers):
     """Tries to find a button on page containg any string in input list.
     Args:
         triggers (list): A list of strings to look for.
     Returns:
-        WebDriverElement: The found element, if any.
+        WebElement: The found element, if any.
     """
-    elemTypes = ["button", "input", "a"]
-    for t in elemTypes:
-        log.debug("Looking for element by type {}.", t)
-        elems = browser.find_by_tag(t)
-        for elem in elems:
-            elemText = elem.value or elem.text
-            if not elemText:
-                continue
-            # Make lowercase, remove spaces,tabs,newlines,non alphab chars.
-            elemText = "".join(char for char in elemText if char.isalpha())
-            elemText = "".join(elemText.lower().split())
-            # Compare against list
-            for trig in triggers:
-                if trig in elemText:
-                    return elem
-    # Did not find any element.
-    log.debug("Did not find any element.")
-    return None
+    return match_buttons(browser, {"btn": triggers})["btn"]
 
 
 def _get_parent_of_btn(browser, elem):
-    s_elem = elem
-    # While we have a element and parent is not whole html document.
-    while s_elem and get_parent(browser, s_elem).tag_name != "html":
-        props = browser.execute_script(
-            "return window.getComputedStyle(arguments[0], null);", s_elem._element
-        )
-        props = "".join(props)
-        if (
-            s_elem.tag_name == "div"
-            and s_elem._element.rect["height"] > 10
-            and s_elem._element.rect["width"] > (elem._element.rect["width"] * 2) + 50
-            and "flex" in props
-        ):
-            return get_parent(browser, s_elem)
-        s_elem = get_parent(browser, s_elem)
-    return None
+    """Finds the notice around a button, see BTN_PARENT_FN.
+
+    Args:
+        browser (splinter.driver.DriverAPI): The browser to look in.
+        elem (WebElement): The button.
+
+    Returns:
+        WebElement: The found parent, if any.
+    """
+    return browser.execute_script(
+        BTN_PARENT_FN + "return findBtnParent(arguments[0]);", elem
+    )
 
 
 def find_by_btn_parent(browser):
     accept_btn = _findBtnElem(browser, trigsAppr)
     if accept_btn:
-        parent = _get_parent_of_btn(browser, accept_btn)
-        if parent:
-            return parent._element
-        return None
+        return _get_parent_of_btn(browser, accept_btn)
 
 
 def find_settings_by_btn_parent(browser):
     accept_btn = _findBtnElem(browser, trigsSettings)
     if accept_btn:
-        parent = _get_parent_of_btn(browser, accept_btn)
-        if parent:
-            return parent._element
+        return _get_parent_of_btn(browser, accept_btn)
+
+
+### DETECTION BUNDLE ###
+# Runs the whole detection cascade in page, in one round trip. The strategies
+# mirror the Python implementations below. Returns the winning element, the
+# name of the strategy and a score: the number of strategies whose candidate
+# is, contains or is contained by the winner. rulesMissing is set when the
+# generic rules were neither passed nor installed in the document.
+DETECT_NOTICE_JS = (
+    FIXED_PARENT_FN + BTN_PARENT_FN + FULL_WIDTH_FN + MATCH_RULES_FN + """
+    function detectNotice(trigsAppr, specific, excepted, generic) {
+        function isVisible(elem) {
+            return !!(elem.offsetWidth || elem.offsetHeight || elem.getClientRects().length);
+        }
+
+        function normalize(text) {
+            return (text || "").toLowerCase().replace(/[^\\p{L}]/gu, "");
+        }
+
+        function findByCookieString() {
+            const found = [];
+            const result = document.evaluate(
+                "//body//*/text()[contains(translate(., 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), 'cookie')]/parent::*",
+                document, null, XPathResult.ORDERED_NODE_SNAPSHOT_TYPE, null
+            );
+            for (let i = 0; i < result.snapshotLength; i++) {
+                const elem = result.snapshotItem(i);
+                const tag = elem.tagName.toLowerCase();
+                if (tag !== "script" && tag !== "style" && isVisible(elem)) {
+                    found.push(elem);
+                }
+            }
+            return found;
+        }
+
+        function findBtnElem(triggers) {
+            for (const tag of ["button", "input", "a"]) {
+                for (const elem of document.getElementsByTagName(tag)) {
+                    if (!elem.getClientRects().length) continue;
+                    const text = normalize(elem.innerText || elem.value);
+                    if (text && triggers.some(trig => text.includes(trig))) {
+                        return elem;
+                    }
+                }
+            }
+            return null;
+        }
+
+        function findByBtnParent() {
+            const btn = findBtnElem(trigsAppr);
+            return btn ? findBtnParent(btn) : null;
+        }
+
+        function findByFixedParent(elems) {
+            for (const base of elems) {
+                const elem = findFixedParent(base);
+                if (elem && isVisible(elem)) return elem;
+            }
+            return null;
+        }
+
+        function findFullParent(elems) {
+            for (const base of elems) {
+                const elem = findFullWidthParent(base);
+                if (elem && isVisible(elem)) return elem;
+            }
+            return null;
+        }
+
+        let rulesMissing = false;
+        function findByList() {
+            const found = matchRules(specific, excepted, generic);
+            rulesMissing = found === null;
+            return found && found.length > 0 ? found[0] : null;
+        }
+
+        const baseElems = findByCookieString();
+        const candidates = [
+            ["btnParent", findByBtnParent()],
+            ["fixedParent", findByFixedParent(baseElems)],
+            ["fullWidth", findFullParent(baseElems)],
+            ["adblockList", findByList()],
+        ];
+        const winner = candidates.find(([name, elem]) => elem);
+        if (!winner) return {elem: null, strategy: null, score: 0, rulesMissing: rulesMissing};
+        const elem = winner[1];
+        const score = candidates.filter(
+            ([name, other]) => other && (other.contains(elem) || elem.contains(other))
+        ).length;
+        return {elem: elem, strategy: winner[0], score: score, rulesMissing: rulesMissing};
+    }
+    return detectNotice(arguments[0], arguments[1], arguments[2], arguments[3]);
+"""
+)
+
+### CMP FINGERPRINTS ###
+# Most notices come from a few consent platforms (CMPs). cmps.json lists how to
+# recognize each of them, by element ids, globals or script sources, and the
+# css selectors of their notice, settings and buttons. Add a entry there to
+# support another one.
+CMP_PROBE_JS = """
+    function probeCmp(table) {
+        function firstVisible(selector) {
+            if (!selector) return null;
+            try {
+                for (const elem of document.querySelectorAll(selector)) {
+                    const rect = elem.getBoundingClientRect();
+                    if (rect.width > 0 && rect.height > 0) return elem;
+                }
+            } catch (e) {}
+            return null;
+        }
+        const scripts = Array.from(document.scripts, (script) => script.src).filter(Boolean);
+        for (const cmp of table) {
+            let via = null;
+            if ((cmp.ids || []).some((id) => document.getElementById(id))) {
+                via = "id";
+            } else if ((cmp.globals || []).some((name) => name in window)) {
+                via = "global";
+            } else if ((cmp.scripts || []).some((part) => scripts.some((src) => src.includes(part)))) {
+                via = "script";
+            }
+            if (via) return {name: cmp.name, via: via, elem: firstVisible(cmp.notice)};
+        }
+        return null;
+    }
+    return probeCmp(arguments[0]);
+"""
+
+_cmp_table = None
+
+
+def get_cmp_table(path="cmps.json"):
+    """Returns the CMP fingerprint table, the file is only loaded on first use."""
+    global _cmp_table
+    if _cmp_table is None:
+        try:
+            with open(path, "r") as f:
+                _cmp_table = json.load(f)
+            log.debug("Loaded {} CMP fingerprints from {}.", len(_cmp_table), path)
+        except (OSError, ValueError) as e:
+            log.warning("Could not load CMP fingerprints: {}", e)
+            _cmp_table = []
+    return _cmp_table
+
+
+def get_cmp(name):
+    """Gets a CMP from the fingerprint table by name.
+
+    Args:
+        name (str): The name of the CMP, e.g. "OneTrust".
+
+    Returns:
+        dict: The table entry, or None.
+    """
+    for cmp in get_cmp_table():
+        if cmp["name"] == name:
+            return cmp
+    return None
+
+
+def fingerprint_cmp(browser):
+    """Checks if the page uses a known CMP, and finds its notice, in one call
+    to page.
+
+    Args:
+        browser (splinter.driver.DriverAPI): The browser to look in.
+
+    Returns:
+        dict: The name of the CMP, what gave it away (via) and its notice
+        element (or None). None if no known CMP is on the page.
+    """
+    table = get_cmp_table()
+    if not table:
         return None
+    return browser.execute_script(CMP_PROBE_JS, table)
 
 
-def find_cookie_notice(browser):
-    log.info("Trying too find a cookie notice on page...")
+def find_by_selector(root, selector):
+    """Finds the first displayed element matching a selector.
+
+    Args:
+        root: A WebDriver or WebElement to look in.
+        selector (str): The css selector, or None.
+
+    Returns:
+        WebElement: The element, if any.
+    """
+    if not selector:
+        return None
+    try:
+        for elem in root.find_elements_by_css_selector(selector):
+            if elem.is_displayed():
+                return elem
+    except Exception as e:
+        log.debug("CMP selector {} failed: {}", selector, e)
+    return None
+
+
+def match_cmp_buttons(root, cmp, triggers):
+    """Finds buttons by the selectors of a CMP, and the ones it has no
+    selector for (or that are not there) with match_buttons.
+
+    Args:
+        root (WebElement): The element to look within.
+        cmp (dict): The CMP table entry, or None.
+        triggers (dict): Category -> list of strings to look for.
+
+    Returns:
+        dict: Category -> the found WebElement, or None.
+    """
+    hits = {
+        category: find_by_selector(root, (cmp or {}).get(category))
+        for category in triggers
+    }
+    missing = {
+        category: trigs for category, trigs in triggers.items() if not hits[category]
+    }
+    if missing:
+        hits.update(match_buttons(root, missing))
+    return hits
+
+
+# The available detection modes for find_cookie_notice.
+DETECTION_MODES = ["bundle", "python"]
+
+
+def detect_by_bundle(browser):
+    """Runs the detection cascade in page, with the bundle.
+
+    Args:
+        browser (splinter.driver.DriverAPI): The browser to look in.
+
+    Returns:
+        dict: The found element (or None), the strategy name and score.
+    """
+    index = get_rule_index()
+    specific, excepted = index.lookup(browser.url)
+    excepted = list(excepted)
+    # Only send the generic rules along if they are not pinned to the session.
+    generic = None
+    if browser.driver.session_id not in _installed_sessions:
+        generic = index.generic
+    result = browser.execute_script(
+        DETECT_NOTICE_JS, trigsAppr, specific, excepted, generic
+    )
+    if result.pop("rulesMissing", False):
+        # Document was loaded before the rules were installed, or is a frame
+        # of another target, send them along.
+        log.debug("Generic rules not installed in page, sending them.")
+        result = browser.execute_script(
+            DETECT_NOTICE_JS, trigsAppr, specific, excepted, index.generic
+        )
+        result.pop("rulesMissing", None)
+    return result
+
+
+def detect_by_python(browser):
+    """Runs the detection cascade from Python, one strategy at a time.
+
+    Args:
+        browser (splinter.driver.DriverAPI): The browser to look in.
+
+    Returns:
+        dict: The found element (or None), the strategy name and score.
+    """
     # Get all items containg string cookie.
     log.debug("Grabbing all cookie strings.")
     base_elems = find_by_cookie_string(browser)
@@ -332,28 +994,229 @@ def find_cookie_notice(browser):
     log.debug("Looking for parents of consent buttons.")
     elem = find_by_btn_parent(browser)
     if elem:
-        return elem
+        return {"elem": elem, "strategy": "btnParent", "score": None}
     # Checking for FIXED PRNT.
     log.debug("Looking for fixed parents.")
     elem = find_by_fixed_parent(browser, base_elems)
     if elem:
-        return elem
+        return {"elem": elem, "strategy": "fixedParent", "score": None}
     # Next FULL WIDTH.
     log.debug("Looking for full width elems.")
     elem = find_by_full_parent(browser, base_elems)
     if elem:
-        return elem
+        return {"elem": elem, "strategy": "fullWidth", "score": None}
     # Next ADBLOCK LIST.
     log.debug("Looking by ADP blocklist.")
     elem = find_by_list(browser)
     if elem:
-        return elem
-    log.debug("Could not find any notice.")
-    return None
+        return {"elem": elem, "strategy": "adblockList", "score": None}
+    return {"elem": None, "strategy": None, "score": 0}
+
+
+### DETECTION MEMO ###
+# A css path to the found notice, stored with the run so the next crawl of the
+# site can try it before running the cascade. Ids that look generated are
+# skipped, as they change between page loads.
+SELECTOR_PATH_JS = """
+    function selectorPath(elem) {
+        const parts = [];
+        while (elem && elem.nodeType === 1 && elem !== document.documentElement) {
+            const id = elem.id;
+            if (id && /^[A-Za-z][\\w-]*$/.test(id) && !/\\d{3,}/.test(id) &&
+                    document.querySelectorAll("#" + CSS.escape(id)).length === 1) {
+                parts.unshift("#" + CSS.escape(id));
+                break;
+            }
+            let part = elem.tagName.toLowerCase();
+            const parent = elem.parentElement;
+            if (parent) {
+                const same = Array.from(parent.children).filter((kid) => kid.tagName === elem.tagName);
+                if (same.length > 1) part += ":nth-of-type(" + (same.indexOf(elem) + 1) + ")";
+            }
+            parts.unshift(part);
+            elem = parent;
+        }
+        return parts.join(" > ");
+    }
+    return selectorPath(arguments[0]);
+"""
+
+
+def selector_path(elem):
+    """Builds a css selector path to a element, see SELECTOR_PATH_JS.
+
+    Args:
+        elem (WebElement): The element.
+
+    Returns:
+        str: The selector, or None if it could not be made.
+    """
+    try:
+        return elem.parent.execute_script(SELECTOR_PATH_JS, elem) or None
+    except Exception as e:
+        log.debug("Could not build selector path: {}", e)
+        return None
+
+
+# Words a notice mentions, at least one of them. A memo hit without any is
+# some other element that took the place of the notice in the layout.
+NOTICE_WORDS = [
+    "cookie",
+    "consent",
+    "gdpr",
+    "privacy",
+    "tracking",
+    "kakor",
+    "samtyck",
+    "integritet",
+    "personuppgift",
+    "datenschutz",
+    "einwillig",
+]
+
+# Checks that a element still is the notice: same tag as last time (if known)
+# and it mentions one of the notice words.
+MEMO_CHECK_JS = """
+    function isNotice(elem, tag, words) {
+        if (tag && elem.tagName.toLowerCase() !== tag) return false;
+        const text = (elem.innerText || "").toLowerCase();
+        return words.some((word) => text.includes(word));
+    }
+    return isNotice(arguments[0], arguments[1], arguments[2]);
+"""
+
+
+def check_memo_hit(elem, memo):
+    """Checks that the element a memo selector found is still the notice.
+
+    Args:
+        elem (WebElement): The element found by the memo selector.
+        memo (dict): The memo, with the tag of the notice if known.
+
+    Returns:
+        bool: If the element looks like the notice.
+    """
+    try:
+        return bool(
+            elem.parent.execute_script(
+                MEMO_CHECK_JS, elem, memo.get("tag"), NOTICE_WORDS
+            )
+        )
+    except Exception as e:
+        log.debug("Could not check memo hit: {}", e)
+        return False
+
+
+def detect_cookie_notice(browser, mode="bundle", memo=None):
+    """Looks for a cookie notice on the current page. Tries the memo from an
+    earlier crawl first, if given, and the cascade when it misses.
+
+    Args:
+        browser (splinter.driver.DriverAPI): The browser to look in.
+        mode (str, optional): "bundle" runs the cascade in page in one call,
+            "python" runs it step by step. Defaults to "bundle".
+        memo (dict, optional): The detection of an earlier crawl, with its
+            strategy, cmp and selector. Defaults to None.
+
+    Returns:
+        dict: The found element (or None), the strategy name, score, the
+        name of the CMP the page uses (or None), a selector to the element
+        and tag of the element, and if the memo was a "hit" or "miss" (None
+        without memo).
+    """
+    result = None
+    if memo and memo.get("selector"):
+        elem = find_by_selector(browser.driver, memo["selector"])
+        if elem and not check_memo_hit(elem, memo):
+            log.debug("Memo selector found something else than the notice.")
+            elem = None
+        if elem:
+            log.debug("Memo hit, {} found the notice last time.", memo["strategy"])
+            result = {
+                "elem": elem,
+                "strategy": memo["strategy"],
+                "score": None,
+                "cmp": memo.get("cmp"),
+                "selector": memo["selector"],
+                "tag": memo.get("tag"),
+                "memo": "hit",
+            }
+        else:
+            log.debug("Memo miss, running the cascade.")
+    if result is None:
+        result = _detect_by_cascade(browser, mode)
+        elem = result["elem"]
+        result["selector"] = selector_path(elem) if elem else None
+        result["tag"] = elem.tag_name.lower() if elem else None
+        result["memo"] = "miss" if memo and memo.get("selector") else None
+    return result
+
+
+def _detect_by_cascade(browser, mode="bundle"):
+    """Looks for a cookie notice on the current page, from scratch.
+
+    Args:
+        browser (splinter.driver.DriverAPI): The browser to look in.
+        mode (str, optional): The detection mode, see detect_cookie_notice.
+
+    Returns:
+        dict: The found element (or None), the strategy name, score and the
+        name of the CMP the page uses (or None).
+    """
+    log.info("Trying too find a cookie notice on page...")
+    cmp = None
+    try:
+        cmp = fingerprint_cmp(browser)
+    except Exception as e:
+        log.warning("CMP probe failed: {}", e)
+    if cmp:
+        log.debug("Page uses {}, found by {}.", cmp["name"], cmp["via"])
+        if cmp["elem"]:
+            return {
+                "elem": cmp["elem"],
+                "strategy": "cmp",
+                "score": None,
+                "cmp": cmp["name"],
+            }
+    cmpName = cmp["name"] if cmp else None
+    if mode == "bundle":
+        try:
+            result = detect_by_bundle(browser)
+            log.debug(
+                "Bundle found {} with score {}.", result["strategy"], result["score"]
+            )
+            result["cmp"] = cmpName
+            return result
+        except Exception as e:
+            log.warning("Detection bundle failed, falling back to python: {}", e)
+    result = detect_by_python(browser)
+    if not result["elem"]:
+        log.debug("Could not find any notice.")
+    result["cmp"] = cmpName
+    return result
+
+
+def find_cookie_notice(browser, mode="bundle"):
+    """Looks for a cookie notice on the current page.
+
+    Args:
+        browser (splinter.driver.DriverAPI): The browser to look in.
+        mode (str, optional): The detection mode, see detect_cookie_notice.
+
+    Returns:
+        WebElement: The notice element, if any.
+    """
+    return detect_cookie_notice(browser, mode)["elem"]
 
 
-def find_settings(browser):
+def find_settings(browser, cmp=None):
     log.info("Trying too find settings on page...")
+    # A known CMP tells us right where its settings are.
+    if cmp:
+        elem = find_by_selector(browser.driver, cmp.get("settings"))
+        if elem:
+            log.debug("Found {} settings.", cmp["name"])
+            return elem
     # Get all items containg string cookie.
     log.debug("Grabbing all cookie strings.")
     base_elems = find_by_cookie_string(browser)
@@ -1,55 +1,515 @@
+import argparse
+import base64
+import gzip
+import hashlib
+import io
 import json
+import math
 import time
 import pendulum
 import pprint
+import re
 import sys
 import os
+import multiprocessing
+import signal
+import statistics
+import socket
+import threading
 import splinter
 import csv
+import queue
 import selenium
-from langdetect import detect
+from langdetect import DetectorFactory, detect
 from PIL import Image
 from loguru import logger as log
 from splinter import Browser as Sbrowser
 from selenium import webdriver as wd
 from selenium.webdriver.support.color import Color
-from pymongo import MongoClient, ReturnDocument
-from datetime import datetime
+from bson import ObjectId
+from pymongo import (
+    ASCENDING,
+    DESCENDING,
+    IndexModel,
+    MongoClient,
+    ReturnDocument,
+    UpdateOne,
+)
+from pymongo.errors import BulkWriteError
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from collections import deque
 from itertools import islice
-from readability.readability import Readability
-from detectors import find_cookie_notice, find_settings
+from urllib.parse import urlsplit
+from detectors import (
+    BUTTON_TRIGGERS,
+    detect_cookie_notice,
+    find_settings,
+    get_cmp,
+    install_generic_rules,
+    match_cmp_buttons,
+    snapshot_element,
+)
 
 mainPath = os.path.abspath(os.getcwd())
 runId = 0
 
 
-def genPathForScreen(url, name: str):
-    # Make sure we do not have https/http with the url.
-    url = url.replace("https://", "")
-    url = url.replace("http://", "")
-    url = url.replace("/", "")
-    # Dots to -.
-    url = url.replace(".", "-")
-    # Get time.
-    timestamp = (
-        time.strftime("%a")
-        + "_"
-        + time.strftime("%d")
-        + "_"
-        + time.strftime("%b")
-        + "_"
-        + time.strftime("%H")
-        + "_"
-        + time.strftime("%M")
-    )
-    full_path = (
-        os.getcwd() + "/result/screens/" + url + "_" + timestamp + "_" + name + ".png"
+class ArtifactStore:
+    """A content addressed store for screenshots and HTML. Every blob is
+    stored once, under the hash of its content, so identical notices from
+    the same CMP template share one file. Run documents hold the key of the
+    blob, its path relative to the root, like "screens/ab/abcd....png". So
+    runs stay readable wherever the artifacts are copied or mounted.
+
+    Encoding, compression and disk I/O run in a background thread pool, so
+    they never stall a browser session.
+    """
+
+    # Pillow save arguments and file extension, by screenshot format.
+    FORMATS = {
+        "png": (None, "png"),  # Written as captured.
+        "png-opt": ({"format": "PNG", "optimize": True}, "png"),
+        "webp": ({"format": "WEBP", "method": 4}, "webp"),
+        "jpeg": ({"format": "JPEG", "optimize": True}, "jpg"),
+    }
+
+    def __init__(self, root=None, fmt="png", quality=80, workers=2, maxPending=32):
+        """Init class for ArtifactStore
+
+        Args:
+            root (str, optional): Where to store artifacts. Defaults to result/artifacts.
+            fmt (str, optional): Screenshot format, one of FORMATS. Defaults to "png".
+            quality (int, optional): Quality for webp and jpeg. Defaults to 80.
+            workers (int, optional): Amount of writer threads. Defaults to 2.
+            maxPending (int, optional): Max blobs waiting to be written, before puts block. Defaults to 32.
+        """
+        self.root = root or os.path.join(mainPath, "result", "artifacts")
+        self.fmt = fmt
+        self.quality = quality
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix="artifacts")
+        self.slots = threading.BoundedSemaphore(maxPending)
+        self.known = set()  # Keys we know are stored or queued.
+
+    @staticmethod
+    def _key(kind, digest, ext):
+        return "/".join([kind, digest[:2], digest + "." + ext])
+
+    def resolve(self, key):
+        """Gets the file path of a key, under our root.
+
+        Args:
+            key (str): The key from a run document.
+
+        Returns:
+            str: The path.
+        """
+        return os.path.join(self.root, *key.split("/"))
+
+    def _submit(self, key, write, data):
+        if key in self.known or os.path.exists(self.resolve(key)):
+            self.known.add(key)
+            return key
+        self.known.add(key)
+        self.slots.acquire()
+        try:
+            self.executor.submit(self._write, key, write, data)
+        except Exception:
+            self.slots.release()
+            self.known.discard(key)
+            raise
+        return key
+
+    def putScreen(self, png: bytes):
+        """Stores a screenshot.
+
+        Args:
+            png (bytes): The screenshot, as captured by the driver.
+
+        Returns:
+            str: The key of the stored screenshot.
+        """
+        digest = hashlib.sha256(png).hexdigest()
+        key = self._key("screens", digest, self.FORMATS[self.fmt][1])
+        return self._submit(key, self._encodeScreen, png)
+
+    def putHtml(self, html: str):
+        """Stores a HTML blob, gzipped.
+
+        Args:
+            html (str): The HTML.
+
+        Returns:
+            str: The key of the stored HTML, or None if there was no HTML.
+        """
+        if html is None:
+            return None
+        data = html.encode("utf-8")
+        key = self._key("html", hashlib.sha256(data).hexdigest(), "html.gz")
+        return self._submit(key, gzip.compress, data)
+
+    def _encodeScreen(self, png):
+        saveArgs, _ = self.FORMATS[self.fmt]
+        if saveArgs is None:
+            return png
+        image = Image.open(io.BytesIO(png))
+        if saveArgs["format"] == "JPEG":
+            image = image.convert("RGB")
+        out = io.BytesIO()
+        image.save(out, quality=self.quality, **saveArgs)
+        return out.getvalue()
+
+    def _write(self, key, encode, data):
+        path = self.resolve(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write to a temp file first, other workers might store the same blob.
+            tmpPath = "{}.{}.{}.tmp".format(path, os.getpid(), threading.get_ident())
+            with open(tmpPath, "wb") as f:
+                f.write(encode(data))
+            os.replace(tmpPath, path)
+        except Exception as e:
+            log.error("Could not write artifact {}: {}", path, e)
+            self.known.discard(key)
+        finally:
+            self.slots.release()
+
+    def read(self, key):
+        """Reads back a stored artifact.
+
+        Args:
+            key (str): The key from a run document.
+
+        Returns:
+            bytes/str: The screenshot bytes or the HTML.
+        """
+        with open(self.resolve(key), "rb") as f:
+            data = f.read()
+        if key.endswith(".html.gz"):
+            return gzip.decompress(data).decode("utf-8")
+        return data
+
+    def close(self):
+        """Waits for all queued artifacts to be written."""
+        self.executor.shutdown(wait=True)
+
+
+# Options for the artifact store of this process, created on first use so
+# that forked workers get their own threads.
+artifactOptions = {}
+artifactStore = None
+
+
+def getArtifactStore():
+    global artifactStore
+    if artifactStore is None:
+        artifactStore = ArtifactStore(**artifactOptions)
+    return artifactStore
+
+
+def closeArtifactStore():
+    global artifactStore
+    if artifactStore is not None:
+        artifactStore.close()
+        artifactStore = None
+
+
+# Resolves once the page has been quiet (no DOM mutations, no new finished
+# requests, loaded) for quietFor seconds, once a new visible element matching
+# selector has appeared and settled for half that time, or after timeout.
+WAIT_FOR_QUIET_JS = """
+    const [timeout, quietFor, selector] = arguments;
+    const done = arguments[arguments.length - 1];
+    const start = performance.now();
+    let last = start;
+    let resources = performance.getEntriesByType("resource").length;
+    const before = new Set(selector ? document.querySelectorAll(selector) : []);
+    const observer = new MutationObserver(() => { last = performance.now(); });
+    observer.observe(document.documentElement || document, {
+        childList: true, subtree: true, attributes: true, characterData: true,
+    });
+    function appeared() {
+        if (!selector) return false;
+        return Array.from(document.querySelectorAll(selector)).some(
+            elem => !before.has(elem) && (elem.offsetWidth || elem.offsetHeight)
+        );
+    }
+    function finish(reason) {
+        observer.disconnect();
+        clearInterval(timer);
+        done({reason: reason, waited: (performance.now() - start) / 1000});
+    }
+    const timer = setInterval(() => {
+        const now = performance.now();
+        const count = performance.getEntriesByType("resource").length;
+        if (count !== resources) {
+            resources = count;
+            last = now;
+        }
+        const quiet = (now - last) / 1000;
+        if (document.readyState === "complete" && quiet >= quietFor) {
+            finish("quiet");
+        } else if (quiet >= quietFor / 2 && appeared()) {
+            finish("candidate");
+        } else if (now - start >= timeout * 1000) {
+            finish("timeout");
+        }
+    }, 50);
+"""
+
+# Elements that show up when a settings dialog is opened.
+SETTINGS_CANDIDATES = "iframe, [role='dialog'], [aria-modal='true']"
+
+# Finds the largest visible settings candidate or fixed position overlay near
+# the top of the document. Returns its rect in document coordinates, or null.
+FIND_REGION_JS = """
+    function findRegion(selector) {
+        const elems = new Set(document.querySelectorAll(selector));
+        // Overlays sit close to the body, no need to check every element.
+        let level = document.body ? Array.from(document.body.children) : [];
+        for (let depth = 0; depth < 3; depth++) {
+            const next = [];
+            for (const elem of level) {
+                const position = getComputedStyle(elem).position;
+                if (position === "fixed" || position === "sticky") elems.add(elem);
+                next.push(...elem.children);
+            }
+            level = next;
+        }
+        let best = null;
+        let bestArea = 0;
+        for (const elem of elems) {
+            const rect = elem.getBoundingClientRect();
+            const area = rect.width * rect.height;
+            if (area > bestArea) {
+                best = rect;
+                bestArea = area;
+            }
+        }
+        if (!best) return null;
+        return {
+            x: best.left + window.scrollX,
+            y: best.top + window.scrollY,
+            width: best.width,
+            height: best.height,
+        };
+    }
+    return findRegion(arguments[0]);
+"""
+
+
+# Cheap signals of the page language, and if there are none, a sample of the
+# visible text of at most arguments[0] characters. Walks text nodes, so the
+# cost does not grow with the page like body.innerText does. Text in elements
+# that are not rendered is skipped.
+LANG_SIGNALS_JS = """
+    function langSignals(maxChars) {
+        const htmlLang = document.documentElement.getAttribute("lang");
+        if (htmlLang && htmlLang.trim()) {
+            return {lang: htmlLang.trim(), source: "htmlLang", text: null};
+        }
+        const meta = document.querySelector("meta[http-equiv='content-language' i]");
+        if (meta && meta.content && meta.content.trim()) {
+            return {lang: meta.content.split(",")[0].trim(), source: "contentLanguage", text: null};
+        }
+        const skip = new Set(["SCRIPT", "STYLE", "NOSCRIPT", "TEMPLATE"]);
+        const walker = document.createTreeWalker(document.body || document.documentElement, NodeFilter.SHOW_TEXT, {
+            acceptNode: (node) => {
+                const parent = node.parentElement;
+                if (!parent || skip.has(parent.nodeName) || !parent.getClientRects().length) {
+                    return NodeFilter.FILTER_REJECT;
+                }
+                return NodeFilter.FILTER_ACCEPT;
+            },
+        });
+        let text = "";
+        while (text.length < maxChars && walker.nextNode()) {
+            const part = walker.currentNode.nodeValue.trim();
+            if (part) text += part + " ";
+        }
+        return {lang: null, source: null, text: text.slice(0, maxChars)};
+    }
+    return langSignals(arguments[0]);
+"""
+# How much text to detect the language from.
+LANG_SAMPLE_CHARS = 2000
+# Makes langdetect give the same answer for the same text, every run.
+DetectorFactory.seed = 0
+# The language detected from the text of hosts we have seen, in this process.
+langCache = {}
+
+
+def captureClip(driver, rect, margin=20, maxSize=(1920, 2160), scale=1.0):
+    """Screenshots a region of the page, in one CDP call.
+
+    Args:
+        driver (WebDriver): The selenium driver.
+        rect (dict): x, y, width and height of the region, in document coordinates.
+        margin (int, optional): Pixels to add around the region. Defaults to 20.
+        maxSize (tuple, optional): Max width and height of the capture. Defaults to (1920, 2160).
+        scale (float, optional): Downscale factor of the image. Defaults to 1.0.
+
+    Returns:
+        bytes: The screenshot as PNG.
+    """
+    x = max(0, rect["x"] - margin)
+    y = max(0, rect["y"] - margin)
+    clip = {
+        "x": x,
+        "y": y,
+        "width": max(1, min(rect["x"] + rect["width"] + margin - x, maxSize[0])),
+        "height": max(1, min(rect["y"] + rect["height"] + margin - y, maxSize[1])),
+        "scale": scale,
+    }
+    res = driver.execute_cdp_cmd(
+        "Page.captureScreenshot",
+        {"format": "png", "clip": clip, "captureBeyondViewport": True},
     )
-    # Make sure path exists...
-    dir = os.path.dirname(full_path)
-    if not os.path.exists(dir):
-        os.makedirs(dir)
-    return full_path
+    return base64.b64decode(res["data"])
+
+
+def waitForQuiet(browser, timeout=5, quietFor=0.5, selector=None):
+    """Waits until the page has settled, instead of sleeping a fixed time.
+
+    Args:
+        browser (WebDriver): The browser to wait in.
+        timeout (int, optional): The max amount of seconds to wait. Defaults to 5.
+        quietFor (float, optional): Seconds without changes that counts as settled. Defaults to 0.5.
+        selector (str, optional): Stop early when a new element matching this appears.
+
+    Returns:
+        dict: Why the wait ended ("quiet", "candidate", "timeout" or "error")
+        and how many seconds it took.
+    """
+    startedAt = time.monotonic()
+    # The page might still be unloading after a click, then try again once.
+    for _ in range(2):
+        remaining = timeout - (time.monotonic() - startedAt)
+        if remaining <= 0:
+            break
+        try:
+            res = browser.driver.execute_async_script(
+                WAIT_FOR_QUIET_JS, remaining, quietFor, selector
+            )
+            return {
+                "reason": res["reason"],
+                "waited": round(time.monotonic() - startedAt, 3),
+            }
+        except Exception as e:
+            log.debug("Could not wait in page: {}", e)
+            time.sleep(min(quietFor, max(remaining, 0)))
+    return {"reason": "error", "waited": round(time.monotonic() - startedAt, 3)}
+
+
+class ScanTimeout(Exception):
+    """Raised when a scan has used up its time budget."""
+
+
+class Deadline:
+    """A time budget for scanning one url, shared by all stages of the scan.
+
+    A watchdog kills the browser session when the scan is still stuck in a
+    browser call a grace period after the budget ran out.
+    """
+
+    def __init__(self, browser, budget=90, grace=10):
+        """Init class for Deadline
+
+        Args:
+            browser (WebDriver): The browser the scan runs in.
+            budget (int, optional): Seconds the whole scan may take. Defaults to 90.
+            grace (int, optional): Extra seconds before the watchdog kills the session. Defaults to 10.
+        """
+        self.browser = browser
+        self.budget = budget
+        self.stage = "start"  # The stage the scan has reached.
+        self.killed = False  # If the watchdog had to kill the session.
+        self.startedAt = time.monotonic()
+        self.watchdog = threading.Timer(budget + grace, self._kill)
+        self.watchdog.daemon = True
+
+    def start(self):
+        self.watchdog.start()
+        return self
+
+    def stop(self):
+        self.watchdog.cancel()
+
+    def remaining(self):
+        return self.budget - (time.monotonic() - self.startedAt)
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def enter(self, stage):
+        """Moves the scan on to the next stage, if there is time left.
+
+        Args:
+            stage (str): The name of the stage.
+
+        Raises:
+            ScanTimeout: If the budget has been used up.
+        """
+        if self.expired():
+            raise ScanTimeout(self.stage)
+        log.debug("Entering stage {}, {:.1f}s left.", stage, self.remaining())
+        self.stage = stage
+
+    def _kill(self):
+        self.killed = True
+        log.warning(
+            "Scan stuck in stage {} past its budget, killing browser.", self.stage
+        )
+        try:
+            # Killing chromedriver makes the blocked browser call fail right
+            # away, killing its Chrome processes too keeps them from leaking.
+            killProcessTree(self.browser.driver.service.process.pid)
+        except Exception as e:
+            log.exception(e)
+
+
+def childProcesses(pid):
+    """Finds all processes started by a process, and by those, from /proc.
+
+    Args:
+        pid (int): The process id.
+
+    Returns:
+        list: The process ids of the descendants, empty where there is no /proc.
+    """
+    children = {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else []:
+        if not entry.isdigit():
+            continue
+        try:
+            with open("/proc/{}/stat".format(entry)) as f:
+                # The parent pid is the second field after the command name.
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue  # The process ended while we looked.
+        children.setdefault(ppid, []).append(int(entry))
+    found = []
+    stack = [pid]
+    while stack:
+        for child in children.get(stack.pop(), []):
+            found.append(child)
+            stack.append(child)
+    return found
+
+
+def killProcessTree(pid):
+    """Kills a process and all its descendants.
+
+    Args:
+        pid (int): The process id.
+    """
+    # Collect the tree first, killed processes get their children reparented.
+    for proc in [pid] + childProcesses(pid):
+        try:
+            os.kill(proc, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
 
 
 class Logger:
@@ -58,35 +518,109 @@ class Logger:
     def __init__(self, log):
         # This function sets up a default logger for the crawler.
         log.remove()
-        extra = {"url": "NURL"}
+        extra = {"url": "NURL", "worker": "main"}
         log.configure(extra=extra)
+        # Sinks are enqueued so that forked crawl workers can share them.
         log.add(
             sys.stdout,
             colorize=True,
-            format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level}</level> | {extra[url]} |<cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>",
+            format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level}</level> | {extra[worker]} | {extra[url]} |<cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>",
+            enqueue=True,
         )
         log.add(
             "logs/logs.log",
-            format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level}</level> | {extra[url]} |<cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>",
+            format="<green>{time:YYYY-MM-DD HH:mm:ss.SSS}</green> | <level>{level}</level> | {extra[worker]} | {extra[url]} |<cyan>{name}</cyan>:<cyan>{function}</cyan> - <level>{message}</level>",
             rotation="1 day",
+            enqueue=True,
         )
         log.info("Starting log...")
 
 
 class DatabaseManager:
-    """This class provides connection to the MongoDB database."""
+    """This class provides connection to the MongoDB database.
+
+    Writes to runs are buffered and sent in unordered bulk writes from a
+    background thread, so the crawl does not wait on the database. Call
+    close() to flush what is left.
+
+    Reads do not wait for the queued writes, call flush() first to read
+    them back. The campaign wide queries, like plan_campaign, do.
+    """
+
+    # The indexes our queries rely on, made at startup.
+    INDEXES = [
+        IndexModel([("url", ASCENDING), ("runStartTime", DESCENDING)], name="url_time"),
+        IndexModel(
+            [("status", ASCENDING), ("runStartTime", DESCENDING)], name="status_time"
+        ),
+    ]
+    # The indexes of the url queue, see claim_url.
+    QUEUE_INDEXES = [
+        IndexModel(
+            [("campaign", ASCENDING), ("url", ASCENDING)],
+            name="campaign_url",
+            unique=True,
+        ),
+        IndexModel(
+            [("campaign", ASCENDING), ("state", ASCENDING), ("rank", ASCENDING)],
+            name="campaign_state_rank",
+        ),
+    ]
+    # Leaves out the html and text of runs, for callers that only need metadata.
+    META_PROJECTION = {
+        "notice.html": 0,
+        "notice.text": 0,
+        "notice.apprBtn.html": 0,
+        "notice.moreBtn.html": 0,
+        "settings.html": 0,
+        "settings.text": 0,
+    }
+    # Just enough to tell how a run went.
+    STATUS_PROJECTION = {
+        "url": 1,
+        "status": 1,
+        "runStartTime": 1,
+        "endedAt": 1,
+        "campaign": 1,
+    }
+    # Queued by flush(), makes the writer send its batch without waiting.
+    FLUSH = object()
+    # Times to try a bulk write, before writing the runs one by one.
+    WRITE_ATTEMPTS = 3
+    # Runs with these statuses do not need to be redone.
+    FINISHED_STATUSES = ["runDone", "noNoticeFound", "timedOut"]
 
-    def __init__(self, db_url=None):
+    def __init__(
+        self,
+        db_url=None,
+        campaign=None,
+        batch_size=100,
+        flush_interval=2.0,
+        max_pending=1000,
+    ):
         """Init class for DatabaseManager
 
         Args:
             db_url (string, optional): Database connection string. Defaults to localhost:27017.
+            campaign (string, optional): The crawl campaign new runs belong to. Defaults to None.
+            batch_size (int, optional): Max writes in one bulk write. Defaults to 100.
+            flush_interval (float, optional): Max seconds a write waits in the buffer. Defaults to 2.0.
+            max_pending (int, optional): Writes to buffer before writers block. Defaults to 1000.
         """
+        self.campaign = campaign
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.pending = queue.Queue(max_pending)
+        self.writer = None
+        self.writer_lock = threading.Lock()
+        self.lost_writes = 0  # Run writes that failed for good.
         try:
             log.debug("Connecting to database...")
             self.client = MongoClient(db_url)
             self.db = self.client["ccrawler"]
             self.runs = self.db["runs"]
+            self.queue = self.db["queue"]
+            self.ensure_indexes()
             status = self.status()
             log.debug(
                 "Ready! Running MongoDB {} on host {}.",
@@ -97,6 +631,15 @@ class DatabaseManager:
         except Exception as e:
             log.exception(e)
 
+    def ensure_indexes(self):
+        """Creates the indexes in INDEXES, if they are missing."""
+        try:
+            names = self.runs.create_indexes(self.INDEXES)
+            names += self.queue.create_indexes(self.QUEUE_INDEXES)
+            log.debug("Indexes ready: {}.", ", ".join(names))
+        except Exception as e:
+            log.exception(e)
+
     def status(self):
         try:
             status = self.db.command("serverStatus")
@@ -105,24 +648,27 @@ class DatabaseManager:
             log.exception(e)
 
     def create_run(self, url):
-        """This function generates a Object for a new run, and saves it in the database.
+        """This function generates a Object for a new run, and queues it for the database.
 
         Returns:
             string: The objectId for the generated object.
         """
         try:
+            obj_id = ObjectId()
             new_run = {
                 "url": url,
                 "status": "startingRun",
-                "runStartTime": datetime.now(),
+                # Like all run timestamps in UTC, as the time of the server is.
+                "runStartTime": datetime.utcnow(),
+                "campaign": self.campaign,
             }
-            obj_id = self.runs.insert_one(new_run).inserted_id
+            self._queue_write(obj_id, new_run)
             return obj_id
         except Exception as e:
             log.exception(e)
 
     def modify_run(self, run_id, data):
-        """This function modifies a run.
+        """This function queues a modification of a run.
 
         Args:
             runId (string): the run to edit (objectId).
@@ -131,39 +677,437 @@ class DatabaseManager:
             documentId: The id of the doc modified.
         """
         try:
-            run = self.runs.find_one_and_update(
-                {"_id": run_id}, {"$set": data}, return_document=ReturnDocument.AFTER
-            )
-            return run
+            self._queue_write(run_id, data)
+            return run_id
         except Exception as e:
             log.exception(e)
 
-    def get_run(self, run_id):
+    def flush(self):
+        """Has the writer send what it has queued right away, and waits until
+        all of it is in the database.
+        """
+        if self.writer:
+            self.pending.put(self.FLUSH)
+            self.pending.join()
+
+    def close(self):
+        """Flushes the queued writes, stops the writer thread and closes the
+        connection.
+        """
+        with self.writer_lock:
+            writer, self.writer = self.writer, None
+        if writer:
+            self.pending.put(None)
+            writer.join()
+        if self.lost_writes:
+            log.error("{} run writes were lost.", self.lost_writes)
+        self.client.close()
+
+    def _queue_write(self, run_id, data):
+        """Queues fields to set on a run. Blocks while the queue is full, so a
+        slow database slows down the crawl instead of filling the memory.
+        """
+        with self.writer_lock:
+            if self.writer is None:
+                self.writer = threading.Thread(
+                    target=self._write_loop, name="db-writer", daemon=True
+                )
+                self.writer.start()
+        self.pending.put((run_id, data))
+
+    def _write_loop(self):
+        """Collects queued writes and sends them as bulk writes, when there
+        are batch_size of them or flush_interval has passed.
+        """
+        done = False
+        while not done:
+            batch = {}
+            taken = 0
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.pending.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                taken += 1
+                if item is None:
+                    done = True
+                    break
+                if item is self.FLUSH:
+                    break
+                run_id, data = item
+                # Later writes to the same run go into the same update.
+                batch.setdefault(run_id, {}).update(data)
+            try:
+                if batch:
+                    self._bulk_write(batch)
+            finally:
+                for _ in range(taken):
+                    self.pending.task_done()
+
+    def _bulk_write(self, batch):
+        """Upserts the runs in batch, in one unordered bulk write. Failed
+        writes are retried, they are all idempotent upserts. What still fails
+        after WRITE_ATTEMPTS is written one run at a time, and runs that can
+        not be written at all are logged as errors and counted in lost_writes.
+
+        Args:
+            batch (dict): Fields to set, by run id.
+        """
+        items = list(batch.items())
+        for attempt in range(self.WRITE_ATTEMPTS):
+            ops = [
+                UpdateOne({"_id": run_id}, {"$set": data}, upsert=True)
+                for run_id, data in items
+            ]
+            try:
+                self.runs.bulk_write(ops, ordered=False)
+                log.debug("Wrote {} runs.", len(ops))
+                return
+            except BulkWriteError as e:
+                # Only retry the writes that failed.
+                failed = {error["index"] for error in e.details["writeErrors"]}
+                items = [item for i, item in enumerate(items) if i in failed]
+                log.warning("{} of {} run writes failed: {}", len(items), len(ops), e)
+                if not items:
+                    return
+            except Exception as e:
+                log.warning("Bulk write of {} runs failed: {}", len(ops), e)
+            time.sleep(2**attempt)
+        for run_id, data in items:
+            try:
+                self.runs.update_one({"_id": run_id}, {"$set": data}, upsert=True)
+            except Exception as e:
+                self.lost_writes += 1
+                log.error("Could not write run {}: {}", run_id, e)
+
+    def get_run(self, run_id, projection=None):
         try:
-            run = self.runs.find_one({"_id": run_id})
+            run = self.runs.find_one({"_id": run_id}, projection)
             return run
         except Exception as e:
             log.exception(e)
 
-    def get_last_run_for_url(self, url):
+    def get_last_run_for_url(self, url, projection=None, status=None):
         try:
-            run = self.runs.find({"url": url}).sort("runStartTime", -1).limit(1)
+            query = {"url": url}
+            if status:
+                query["status"] = status
+            run = self.runs.find(query, projection).sort("runStartTime", -1).limit(1)
             return run
         except Exception as e:
             log.exception(e)
 
-    def get_runs_for_url(self, url, limit=None):
+    def get_runs_for_url(self, url, limit=None, projection=None):
         try:
             if limit:
                 runs = (
-                    self.runs.find({"url": url}).sort("runStartTime", -1).limit(limit)
+                    self.runs.find({"url": url}, projection)
+                    .sort("runStartTime", -1)
+                    .limit(limit)
                 )
             else:
-                runs = self.runs.find({"url": url}).sort("runStartTime", -1)
+                runs = self.runs.find({"url": url}, projection).sort("runStartTime", -1)
             return runs
         except Exception as e:
             log.exception(e)
 
+    def get_run_meta(self, run_id):
+        """Gets a run without its html and text.
+
+        Args:
+            run_id (string): The run to get (objectId).
+
+        Returns:
+            dict: The run, or None.
+        """
+        return self.get_run(run_id, self.META_PROJECTION)
+
+    def get_last_status_for_url(self, url):
+        """Gets the status of the latest run for a url.
+
+        Args:
+            url (string): The url.
+
+        Returns:
+            dict: The url, status, runStartTime and endedAt of the run, or None.
+        """
+        try:
+            return self.runs.find_one(
+                {"url": url}, self.STATUS_PROJECTION, sort=[("runStartTime", -1)]
+            )
+        except Exception as e:
+            log.exception(e)
+
+    def plan_campaign(self, urls, fresh_for=None, orphan_after=timedelta(minutes=10)):
+        """Finds the urls left to crawl in our campaign. A url is done when
+        its latest run finished in this campaign, or within fresh_for. Runs
+        stuck in startingRun for longer than orphan_after are marked orphaned,
+        and their urls crawled again. Younger ones may still be running on
+        another machine.
+
+        Args:
+            urls (list): All urls of the campaign, in crawl order.
+            fresh_for (timedelta, optional): How old a finished run may be and still count. Defaults to None.
+            orphan_after (timedelta, optional): How long a run can take, at most. Defaults to 10 minutes.
+
+        Returns:
+            list: The urls left to crawl, in the same order.
+        """
+        self.flush()
+        try:
+            recent = [{"campaign": self.campaign}]
+            if fresh_for:
+                recent.append({"runStartTime": {"$gte": datetime.utcnow() - fresh_for}})
+            # One query for all urls, instead of get_last_run_for_url for each.
+            runs = self.runs.find(
+                {"url": {"$in": list(urls)}, "$or": recent},
+                self.STATUS_PROJECTION,
+            ).sort("runStartTime", -1)
+            last = {}
+            for run in runs:
+                last.setdefault(run["url"], run)
+            done = {
+                url
+                for url, run in last.items()
+                if run["status"] in self.FINISHED_STATUSES
+            }
+            todo = [url for url in urls if url not in done]
+            orphans = self.runs.update_many(
+                {
+                    "url": {"$in": todo},
+                    "campaign": self.campaign,
+                    "status": "startingRun",
+                    # Compared to the time of the server, not ours.
+                    "$expr": {
+                        "$lt": [
+                            "$runStartTime",
+                            {
+                                "$subtract": [
+                                    "$$NOW",
+                                    orphan_after.total_seconds() * 1000,
+                                ]
+                            },
+                        ]
+                    },
+                },
+                {"$set": {"status": "orphaned"}},
+            ).modified_count
+            log.info(
+                "Campaign {}: {} urls done, {} left, {} orphaned runs to retry.",
+                self.campaign,
+                len(urls) - len(todo),
+                len(todo),
+                orphans,
+            )
+            return todo
+        except Exception as e:
+            log.exception(e)
+            return list(urls)
+
+    def enqueue_urls(self, urls):
+        """Adds urls to the queue of our campaign, so workers on any machine
+        can claim them. Urls already in the queue are left as they are.
+
+        Args:
+            urls (list): The urls, in crawl order.
+
+        Returns:
+            int: The amount of urls added.
+        """
+        ops = [
+            UpdateOne(
+                {"campaign": self.campaign, "url": url},
+                {
+                    "$setOnInsert": {
+                        "rank": rank,
+                        "state": "pending",
+                        "attempts": 0,
+                        "owner": None,
+                        "leaseUntil": None,
+                    }
+                },
+                upsert=True,
+            )
+            for rank, url in enumerate(urls)
+        ]
+        try:
+            if not ops:
+                return 0
+            return self.queue.bulk_write(ops, ordered=False).upserted_count
+        except Exception as e:
+            log.exception(e)
+            return 0
+
+    def claim_url(self, owner, lease=120, max_attempts=3):
+        """Claims the next url of our campaign. Takes pending urls, and urls
+        whose lease ran out, as their worker is gone. Leases are timed by the
+        database server, so the clocks of the workers do not matter.
+
+        Args:
+            owner (string): Id of the claiming worker.
+            lease (int, optional): Seconds until the claim runs out, unless renewed. Defaults to 120.
+            max_attempts (int, optional): Times to try a url before giving up on it. Defaults to 3.
+
+        Returns:
+            dict: The queue entry, or None when there is nothing left.
+        """
+        try:
+            return self.queue.find_one_and_update(
+                {
+                    "campaign": self.campaign,
+                    "attempts": {"$lt": max_attempts},
+                    "$or": [
+                        {"state": "pending"},
+                        {
+                            "state": "leased",
+                            "$expr": {"$lt": ["$leaseUntil", "$$NOW"]},
+                        },
+                    ],
+                },
+                [
+                    {
+                        "$set": {
+                            "state": "leased",
+                            "owner": owner,
+                            "leaseUntil": self._lease_until(lease),
+                            "attempts": {"$add": ["$attempts", 1]},
+                        }
+                    }
+                ],
+                sort=[("rank", ASCENDING)],
+                return_document=ReturnDocument.AFTER,
+            )
+        except Exception as e:
+            log.exception(e)
+
+    def heartbeat(self, entry_id, owner, lease=120):
+        """Renews the lease on a claimed url.
+
+        Returns:
+            bool: False if the url is no longer ours.
+        """
+        try:
+            res = self.queue.update_one(
+                {"_id": entry_id, "owner": owner, "state": "leased"},
+                [{"$set": {"leaseUntil": self._lease_until(lease)}}],
+            )
+            return res.matched_count == 1
+        except Exception as e:
+            log.exception(e)
+            return False
+
+    @staticmethod
+    def _lease_until(lease):
+        """The end of a lease starting now, as a update pipeline expression
+        on the time of the server.
+        """
+        return {"$add": ["$$NOW", lease * 1000]}
+
+    def complete_url(self, entry_id, owner, state="done"):
+        """Marks a claimed url as done, or hands it back with state "pending".
+
+        Returns:
+            bool: False if the url was no longer ours.
+        """
+        try:
+            res = self.queue.update_one(
+                {"_id": entry_id, "owner": owner, "state": "leased"},
+                {"$set": {"state": state, "leaseUntil": None}},
+            )
+            return res.matched_count == 1
+        except Exception as e:
+            log.exception(e)
+            return False
+
+    def get_run_durations(self, urls, last=5):
+        """Gets how long the latest runs of urls took, from their startedAt
+        and endedAt.
+
+        Args:
+            urls (list): The urls.
+            last (int, optional): Runs to look at per url. Defaults to 5.
+
+        Returns:
+            dict: The median duration in seconds, by url. Urls without runs are left out.
+        """
+        self.flush()
+        durations = {}
+        try:
+            runs = self.runs.find(
+                {
+                    "url": {"$in": list(urls)},
+                    "startedAt": {"$ne": None},
+                    "endedAt": {"$ne": None},
+                },
+                {"url": 1, "startedAt": 1, "endedAt": 1},
+            ).sort("runStartTime", -1)
+            for run in runs:
+                seen = durations.setdefault(run["url"], [])
+                if len(seen) < last:
+                    seen.append((run["endedAt"] - run["startedAt"]).total_seconds())
+        except Exception as e:
+            log.exception(e)
+        return {url: statistics.median(seen) for url, seen in durations.items()}
+
+    def get_detection_memo(self, url):
+        """Gets how the notice of a url was found the last time it was found.
+
+        Args:
+            url (string): The url.
+
+        Returns:
+            dict: The detection of that run, with strategy, cmp and selector, or None.
+        """
+        try:
+            run = self.runs.find_one(
+                {"url": url, "detection.selector": {"$ne": None}},
+                {"detection": 1},
+                sort=[("runStartTime", -1)],
+            )
+            return run["detection"] if run else None
+        except Exception as e:
+            log.exception(e)
+
+    def get_memo_stats(self):
+        """Counts how often the detection memo hit and missed in our campaign.
+
+        Returns:
+            dict: The amount of runs by memo outcome, "hit", "miss" or None for no memo.
+        """
+        self.flush()
+        try:
+            counts = self.runs.aggregate(
+                [
+                    {"$match": {"campaign": self.campaign}},
+                    {"$group": {"_id": "$detection.memo", "runs": {"$sum": 1}}},
+                ]
+            )
+            return {count["_id"]: count["runs"] for count in counts}
+        except Exception as e:
+            log.exception(e)
+            return {}
+
+    def get_runs_by_status(self, status, since=None, projection=META_PROJECTION):
+        """Gets runs with a status, newest first. Leaves out html and text,
+        unless another projection is given.
+
+        Args:
+            status (string): The status, e.g. "runDone".
+            since (datetime, optional): Only runs started after this, in UTC. Defaults to None.
+            projection (dict, optional): The fields to get. Defaults to META_PROJECTION.
+
+        Returns:
+            Cursor: The runs.
+        """
+        try:
+            query = {"status": status}
+            if since:
+                query["runStartTime"] = {"$gte": since}
+            return self.runs.find(query, projection).sort("runStartTime", -1)
+        except Exception as e:
+            log.exception(e)
+
 
 class ConsentSettings:
     """A class for consent settings."""
@@ -172,86 +1116,37 @@ class ConsentSettings:
         self,
         url,
         consent_elem: selenium.webdriver.remote.webelement.WebElement,
+        cmp=None,
     ):
         self.elem = consent_elem  # The content of the button text.
-        self.html = self.elem.get_attribute("outerHTML")
-        self.text = self.elem.text
+        snapshot = snapshot_element(self.elem)
+        self.html = snapshot["html"]
+        self.text = snapshot["text"]
         self.hasDenyAll = False
         self.hasAcceptAll = False
+        # Readability is computed after the crawl, see analysis.py.
         self.readabilityARI = None
         self.readabilityFLESH = None
         self.scrn = None
+        self.captureMode = None  # How scrn was captured, see PageScanner.
         # Check if we have deny/accept all buttons.
-        self.hasDenyAll = self._find_deny_all()
-        self.hasAcceptAll = self._find_appr_all()
-        # Lets define our readability by ARI and FLESH.
-        r = Readability(self.text)
-        self.readabilityARI = r.ari().__dict__
-        self.readabilityFLESH = r.flesch().__dict__
-        # Lets see if we can find any checkboxes...
-        self.totalCheckboxes = 0
-        self.checkedCheckboxes = 0
-        total_checkboxes = self.elem.find_elements_by_css_selector(
-            "input[type='checkbox']"
-        )
-        checked_checkboxes = self.elem.find_elements_by_css_selector(
-            "input[type='checkbox']:checked"
+        btns = match_cmp_buttons(
+            self.elem,
+            cmp,
+            {
+                "denyAll": BUTTON_TRIGGERS["denyAll"],
+                "acceptAll": BUTTON_TRIGGERS["acceptAll"],
+            },
         )
-        self.totalCheckboxes = len(total_checkboxes)
-        self.checkedCheckboxes = len(checked_checkboxes)
-
-    def _find_deny_all(self):
-        trigs = ["denyall", "alldeny", "rejectall", "nekaalla", "allaneka"]
-        btn = self._findBtnElem(trigs)
-        if btn:
-            return True
-        return False
-
-    def _find_appr_all(self):
-        trigs = [
-            "approveall",
-            "allenable",
-            "acceptall",
-            "enableall",
-            "tillåtalla",
-            "godkännalla",
-        ]
-        btn = self._findBtnElem(trigs)
-        if btn:
-            return True
-        return False
-
-    @log.catch
-    def _findBtnElem(self, triggers):
-        """Tries to find a button on page containg any string in input list.
-
-        Args:
-            triggers (list): A list of strings to look for.
-
-        Returns:
-            WebDriverElement: The found element, if any.
-        """
-        elemTypes = ["button", "input", "a"]
-        for t in elemTypes:
-            elems = self.elem.find_elements_by_tag_name(t)
-            for elem in elems:
-                elemText = elem.text or elem.get_attribute("value")
-                if not elemText:
-                    continue
-                # Make lowercase, remove spaces,tabs,newlines,non alphab chars.
-                elemText = "".join(char for char in elemText if char.isalpha())
-                elemText = "".join(elemText.lower().split())
-                # Compare against list
-                for trig in triggers:
-                    if trig in elemText:
-                        return elem
-        # Did not find any element.
-        log.debug("Did not find any element.")
-        return None
+        self.hasDenyAll = btns["denyAll"] is not None
+        self.hasAcceptAll = btns["acceptAll"] is not None
+        # Lets see if we can find any checkboxes...
+        self.totalCheckboxes = snapshot["totalCheckboxes"]
+        self.checkedCheckboxes = snapshot["checkedCheckboxes"]
 
     def getMeta(self):
         return {
-            "html": self.html,
+            "html": getArtifactStore().putHtml(self.html),
             "text": self.text,
             "hasDenyAll": self.hasDenyAll,
             "hadAcceptAll": self.hasAcceptAll,
@@ -260,6 +1155,7 @@ class ConsentSettings:
             "readabilityARI": self.readabilityARI,
             "readabilityFLESH": self.readabilityFLESH,
             "scrn": self.scrn,
+            "captureMode": self.captureMode,
         }
 
 
@@ -267,75 +1163,56 @@ class Consent:
     """A class for consents."""
 
     def __init__(
-        self, url, consent_elem: selenium.webdriver.remote.webelement.WebElement
+        self,
+        url,
+        consent_elem: selenium.webdriver.remote.webelement.WebElement,
+        cmp=None,
     ):
         self.url = url  # Needed for screenshot cap.
+        self.cmp = cmp  # The CMP table entry, if the page uses a known CMP.
         self.elem = consent_elem  # The content of the button text.
-        self.size = (
-            self.elem.size
-        )  # The size of the consent notice, as webdriver rect dirct.
-        self.links = []
-        self.html = self.elem.get_attribute("outerHTML")
-        self.text = self.elem.text
+        snapshot = snapshot_element(self.elem)
+        self.size = snapshot["size"]  # The size of the consent notice, as rect dict.
+        self.links = snapshot["links"]
+        self.html = snapshot["html"]
+        self.text = snapshot["text"]
         self.apprBtn = None
         self.apprBtnMeta = None
         self.moreBtn = None
         self.moreBtnMeta = None
         self.scrn = None
-        # Look for links
-        for elem in self.elem.find_elements_by_partial_link_text(""):
-            self.links.append(elem.get_attribute("href"))
         # Lets screenshot ourselves.
         self.screenshot()
         # Lets find our buttons.
         self.find_buttons()
+        self.contentHash = self.hashContent()
 
     def screenshot(self):
         # Takes a screenshot of the current notice/element, saves in results
-        # Returns path to screenshot.
-        full_path = genPathForScreen(self.url, "notice")
-        log.debug(full_path)
-        scrn = self.elem.screenshot(full_path)
-        log.debug(scrn)
-        if scrn:
-            self.scrn = full_path
+        # in the background. Returns if we could capture it.
+        try:
+            png = self.elem.screenshot_as_png
+            self.scrn = getArtifactStore().putScreen(png)
+            log.debug(self.scrn)
             return True
-        else:
+        except Exception:
             log.debug("Could not screenshot element!")
             return False
 
     def find_buttons(self):
-        apprTrigs = [
-            "approve",
-            "okay",
-            "accept",
-            "agree",
-            "allow",
-            "continue",
-            "godkänn",
-            "förstår",
-            "stäng",
-        ]
-        apprBtn = self._findBtnElem(apprTrigs)
+        btns = match_cmp_buttons(
+            self.elem,
+            self.cmp,
+            {"approve": BUTTON_TRIGGERS["approve"], "more": BUTTON_TRIGGERS["more"]},
+        )
+        apprBtn = btns["approve"]
         if apprBtn:
             log.debug("FOUND APPROVE BUTTON!")
             apprBtn = Button(self.url, apprBtn)
             apprBtn.screenshot("approve")
             self.apprBtn = apprBtn
             self.apprBtnMeta = apprBtn.getMeta()
-        moreTrigs = [
-            "configure",
-            "manage",
-            "settings",
-            "customize",
-            "customise",
-            "change",
-            "inställningar",
-            "more",
-            "mer",
-            "neka",
-        ]
-        moreBtn = self._findBtnElem(moreTrigs)
+        moreBtn = btns["more"]
         if moreBtn:
             log.debug("FOUND MORE BUTTON!")
             moreBtn = Button(self.url, moreBtn)
@@ -349,34 +1226,19 @@ class Consent:
             self.moreBtn = moreBtn
             self.moreBtnMeta = moreBtn.getMeta()
 
-    @log.catch
-    def _findBtnElem(self, triggers):
-        """Tries to find a button on page containg any string in input list.
-
-        Args:
-            triggers (list): A list of strings to look for.
+    def hashContent(self):
+        """Hashes the notice html and its buttons, to tell if the notice changed
+        since the last crawl. Whitespace and long numbers, like timestamps and
+        generated ids, are left out as they change between loads.
 
         Returns:
-            WebDriverElement: The found element, if any.
-        """
-        elemTypes = ["button", "input", "a"]
-        for t in elemTypes:
-            log.debug("Looking for element by type {}.", t)
-            elems = self.elem.find_elements_by_tag_name(t)
-            for elem in elems:
-                elemText = elem.text or elem.get_attribute("value")
-                if not elemText:
-                    continue
-                # Make lowercase, remove spaces,tabs,newlines,non alphab chars.
-                elemText = "".join(char for char in elemText if char.isalpha())
-                elemText = "".join(elemText.lower().split())
-                # Compare against list
-                for trig in triggers:
-                    if trig in elemText:
-                        return elem
-        # Did not find any element.
-        log.debug("Did not find any element.")
-        return None
+            str: The sha256 hex digest.
+        """
+        html = re.sub(r"\d{3,}", "", self.html or "")
+        parts = [" ".join(html.split())]
+        for btn in (self.apprBtnMeta, self.moreBtnMeta):
+            parts.append(json.dumps(btn and [btn["text"], btn["redirect"]]))
+        return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
 
     @log.catch
     def _findMoreLink(self):
@@ -396,11 +1258,13 @@ class Consent:
         return {
             "size": self.size,
             "links": self.links,
-            "html": self.html,
+            "html": getArtifactStore().putHtml(self.html),
             "text": self.text,
             "apprBtn": self.apprBtnMeta,
             "moreBtn": self.moreBtnMeta,
             "scrn": self.scrn,
+            "cmp": self.cmp["name"] if self.cmp else None,
+            "contentHash": self.contentHash,
         }
 
 
@@ -421,33 +1285,28 @@ class Button:
         if btnElem:
             # Lets not forget the element.
             self.elem = btnElem
-            # Now lets fill out the apprBtn extras from button.
-            if self.elem:
-                self.text = self.elem.text or self.elem.get_attribute("value")
-                self.type = self.elem.tag_name
-                self.html = self.elem.get_attribute("outerHTML")
-            if self.elem.size:
-                self.size = self.elem.size
-            if self.elem.get_attribute("href"):
-                self.redirect = self.elem.get_attribute("href")
-            if self.elem.value_of_css_property("background-color"):
-                self.color = Color.from_string(
-                    self.elem.value_of_css_property("background-color")
-                ).hex
-            if self.elem.value_of_css_property("color"):
-                self.textColor = Color.from_string(
-                    self.elem.value_of_css_property("color")
-                ).hex
+            # Now lets fill out the apprBtn extras from button, in one go.
+            snapshot = snapshot_element(self.elem)
+            self.text = snapshot["text"] or snapshot["value"]
+            self.type = snapshot["tagName"]
+            self.html = snapshot["html"]
+            if snapshot["size"]:
+                self.size = snapshot["size"]
+            if snapshot["href"]:
+                self.redirect = snapshot["href"]
+            if snapshot["backgroundColor"]:
+                self.color = Color.from_string(snapshot["backgroundColor"]).hex
+            if snapshot["color"]:
+                self.textColor = Color.from_string(snapshot["color"]).hex
 
     def screenshot(self, name: str):
         # Takes a screenshot of the current notice/element, saves in results
-        # Returns path to screenshot.
-        full_path = genPathForScreen(self.url, name)
-        scrn = self.elem.screenshot(full_path)
-        if scrn:
-            self.scrn = full_path
+        # in the background. Returns if we could capture it.
+        try:
+            png = self.elem.screenshot_as_png
+            self.scrn = getArtifactStore().putScreen(png)
             return True
-        else:
+        except Exception:
             log.debug("Could not screenshot element!")
             return False
 
@@ -458,7 +1317,7 @@ class Button:
             "textColor": self.textColor,
             "type": self.type,
             "redirect": self.redirect,
-            "html": self.html,
+            "html": getArtifactStore().putHtml(self.html),
             "scrn": self.scrn,
             "size": self.size,
         }
@@ -576,41 +1435,83 @@ class PageScanner:
         self.db = db
         # Window size.
         self.windowSize = self.browser.driver.get_window_size()
+        # Which resources the browser blocks, see setupDriver.
+        self.crawlMode = getattr(
+            self.browser,
+            "crawlMode",
+            {
+                "fast": False,
+                "blockTrackers": False,
+                "imagesOff": False,
+                "blockedUrls": 0,
+            },
+        )
         # Timings.
         self.startedAt = None
         self.endedAt = None
         # Metadata.
         self.url = url  # The url we start at.
         self.lang = None  # The website language.
+        self.langSource = None  # Where we got the language from.
         self.scrn = None  # Screenshot of first load.
         self.consent = None  # Consent element.
         self.conset = None
         # Cookies.
         self.startCookies = None  # The cookies that gets set at start.
         self.endCookies = None  # The cookies after the run has been done.
+        # Waits.
+        self.waits = []  # How long each wait for the page took.
+        self.detection = None  # How the notice was found, and the CMP if known.
+        self.reused = None  # The last run, if its settings are reused.
 
     @log.catch
-    def doScan(self, followLinks=True, screenshot=True):
+    def doScan(
+        self,
+        followLinks=True,
+        screenshot=True,
+        budget=90,
+        capture="clip",
+        captureScale=1.0,
+        captureMaxSize=(1920, 2160),
+        useMemo=True,
+        forceFull=False,
+    ):
         """Do a scan of the current url we are at.
 
         Args:
             followLinks (bool, optional): If we should follow links/hrefs to settings. Defaults to True.
             screenshot (bool, optional): If we should screenshot all found elements. Defaults to True.
+            budget (int, optional): Seconds the whole scan may take. Defaults to 90.
+            capture (str, optional): How to screenshot settings we could not find an element for, "clip" to the likely settings region or "full" page. Defaults to "clip".
+            captureScale (float, optional): Downscale factor for clipped captures. Defaults to 1.0.
+            captureMaxSize (tuple, optional): Max width and height of clipped captures. Defaults to (1920, 2160).
+            useMemo (bool, optional): If we should first look where the notice was found last crawl. Defaults to True.
+            forceFull (bool, optional): Look through the settings even if the notice has not changed since last crawl. Defaults to False.
         """
+        self.capture = {
+            "mode": capture,
+            "scale": captureScale,
+            "maxSize": list(captureMaxSize),
+        }
+        self.deadline = Deadline(self.browser, budget).start()
         try:
-            self.startedAt = datetime.now()
+            self.startedAt = datetime.utcnow()
             self.runId = self.db.create_run(self.url)
             # Clear cookies and local storage before run.
             log.debug("Clearing cookies, preparing for run...")
             self.browser.cookies.delete()
-            # Navigate to page.
-            self.browser.visit(self.url)
+            # Navigate to page, within what is left of our budget.
+            self.deadline.enter("navigate")
+            self._visit(self.url)
             log.debug("Navigated to url.")
             # Lets figure out the language
             self._resolveLang()
             # Screenshot
-            self.browser.driver.save_screenshot(genPathForScreen(self.url, "full"))
-            self.scrn = genPathForScreen(self.url, "full")
+            self.deadline.enter("screenshot")
+            self.scrn = getArtifactStore().putScreen(
+                self.browser.driver.get_screenshot_as_png()
+            )
+            self.deadline.enter("detect")
             # Lets check for iframes.
             iframe = self._iframeHandler()
             self.iframe = iframe
@@ -618,36 +1519,49 @@ class PageScanner:
             self.startCookies = self.browser.cookies.all(True)
             # Lets find our consent notice.
             log.info("Looking for cookie notice!")
-            consent = find_cookie_notice(self.browser)
+            memo = self.db.get_detection_memo(self.url) if useMemo else None
+            detection = detect_cookie_notice(self.browser, memo=memo)
+            self.detection = {
+                "strategy": detection["strategy"],
+                "score": detection["score"],
+                "cmp": detection["cmp"],
+                "selector": detection["selector"],
+                "tag": detection["tag"],
+                "memo": detection["memo"],
+            }
+            cmp = get_cmp(detection["cmp"]) if detection["cmp"] else None
+            consent = detection["elem"]
             if consent:
-                self.consent = Consent(self.url, consent)
+                self.deadline.enter("notice")
+                self.consent = Consent(self.url, consent, cmp)
+                # Same notice as last crawl, same settings, no need to go there.
+                if not forceFull:
+                    self.reused = self._findReusable()
                 # Now lets see if we can do some settings...
-                if self.consent.moreBtn:
+                if self.reused:
+                    log.info("Notice unchanged, reusing settings from last run.")
+                elif self.consent.moreBtn:
+                    self.deadline.enter("settings")
                     # We have a more button, we should click it and see what happens.
                     # Is it a redirect or a JS click?
                     if self.consent.moreBtn.redirect:
                         # It is just a redir to another page, lets visit.
-                        self.browser.visit(self.consent.moreBtn.redirect)
-                        time.sleep(5)  # Sleep after load.
+                        self._visit(self.consent.moreBtn.redirect)
+                        self._wait("moreRedirect")  # Wait for the page to settle.
                         # Now we should be on settings page, screenshot.
-                        settings_elem = find_settings(self.browser)
+                        settings_elem = find_settings(self.browser, cmp)
                         if settings_elem:
                             # We have an element with settings.
-                            self.conset = ConsentSettings(self.url, settings_elem)
-                            settings_elem.screenshot(
-                                genPathForScreen(self.url, "settings")
-                            )
-                            self.conset.scrn = genPathForScreen(self.url, "settings")
+                            self.conset = ConsentSettings(self.url, settings_elem, cmp)
+                            self.conset.scrn = self._screenElem(settings_elem)
+                            self.conset.captureMode = "element"
                         else:
                             # We cant find the element, lets go with the whole page.
                             self.conset = ConsentSettings(
                                 self.url,
                                 self.browser.find_by_tag("body").first._element,
                             )
-                            scrn = self.browser.screenshot(
-                                genPathForScreen(self.url, "settings"), full=True
-                            )
-                            self.conset.scrn = scrn
+                            self._screenSettingsFallback()
                     else:
                         # It is by 99,999999%(or something like that) chance a JS button, lets click, wait 5 seconds and then do some work!
                         curUrl = self.browser.url
@@ -664,7 +1578,8 @@ class PageScanner:
                         if not aldr_at_lvl:
                             self.consent.moreBtn.elem.click()
                             self.browser.driver.switch_to.default_content()  # Exit the current iframe, it might have created a new one...
-                            time.sleep(5)  # Sleep after click.
+                            # Wait for the click to settle.
+                            self._wait("moreClick", SETTINGS_CANDIDATES)
                             if self.browser.url == curUrl:
                                 # Same page, check for iframes.
                                 frames = self.browser.find_by_tag("iframe")
@@ -679,38 +1594,27 @@ class PageScanner:
                                         found_frame._element
                                     )
                                 # Iframes check done, now look for settings element.
-                                settings_elem = find_settings(self.browser)
+                                settings_elem = find_settings(self.browser, cmp)
                                 if settings_elem:
                                     self.conset = ConsentSettings(
-                                        self.url, settings_elem
-                                    )
-                                    settings_elem.screenshot(
-                                        genPathForScreen(self.url, "settings")
-                                    )
-                                    self.conset.scrn = genPathForScreen(
-                                        self.url, "settings"
+                                        self.url, settings_elem, cmp
                                     )
+                                    self.conset.scrn = self._screenElem(settings_elem)
+                                    self.conset.captureMode = "element"
                                 else:
                                     # Fallback to whole page.
                                     self.conset = ConsentSettings(
                                         self.url,
                                         self.browser.find_by_tag("body").first._element,
                                     )
-                                    scrn = self.browser.screenshot(
-                                        genPathForScreen(self.url, "settings"),
-                                        full=True,
-                                    )
-                                    self.conset.scrn = scrn
+                                    self._screenSettingsFallback()
                             else:
                                 # We are on a new page now again, screenshot whole page.
                                 self.conset = ConsentSettings(
                                     self.url,
                                     self.browser.find_by_tag("body").first._element,
                                 )
-                                scrn = self.browser.screenshot(
-                                    genPathForScreen(self.url, "settings"), full=True
-                                )
-                                self.conset.scrn = scrn
+                                self._screenSettingsFallback()
                             # Lets look for settings button.
                         else:
                             # As we are at settings, then just set that to elem and screen.
@@ -718,40 +1622,55 @@ class PageScanner:
                                 self.url,
                                 self.consent.elem,
                             )
-                            scrn = self.consent.elem.screenshot(
-                                genPathForScreen(self.url, "settings")
-                            )
-                            self.conset.scrn = genPathForScreen(self.url, "settings")
-                self.endedAt = datetime.now()
+                            self.conset.scrn = self._screenElem(self.consent.elem)
+                            self.conset.captureMode = "element"
+                self.endedAt = datetime.utcnow()
                 self.db.modify_run(
                     self.runId,
                     {
                         "status": "runDone",
                         "browserSize": self.windowSize,
+                        "crawlMode": self.crawlMode,
                         "startedAt": self.startedAt,
                         "endedAt": self.endedAt,
                         "lang": self.lang,
+                        "langSource": self.langSource,
                         "scrn": self.scrn,
                         "notice": self.consent.getMeta(),
-                        "settings": self.conset.getMeta(),
+                        "settings": (
+                            self.reused["settings"]
+                            if self.reused
+                            else self.conset.getMeta()
+                        ),
+                        "reused": (
+                            {"from": self.reused["_id"]} if self.reused else None
+                        ),
                         "startCookies": self.startCookies,
                         "endCookies": self.endCookies,
+                        "waits": self.waits,
+                        "capture": self.capture,
+                        "detection": self.detection,
                     },
                 )
             else:
                 # We have no notice, lets skip this page and return error to db.
-                self.endedAt = datetime.now()
+                self.endedAt = datetime.utcnow()
                 self.db.modify_run(
                     self.runId,
                     {
                         "status": "noNoticeFound",
                         "browserSize": self.windowSize,
+                        "crawlMode": self.crawlMode,
                         "startedAt": self.startedAt,
                         "endedAt": self.endedAt,
                         "lang": self.lang,
+                        "langSource": self.langSource,
                         "scrn": self.scrn,
                         "startCookies": self.startCookies,
                         "endCookies": self.endCookies,
+                        "waits": self.waits,
+                        "capture": self.capture,
+                        "detection": self.detection,
                     },
                 )
                 return None
@@ -760,9 +1679,136 @@ class PageScanner:
             # Done with first crawl, now if we had settings lets check them out.
             # TODO: Start looking for settings, check flowchart #3.
         except:
-            # Log stuff here.
-            e = sys.exc_info()[0]
-            log.exception(e)
+            if self.deadline.killed or self.deadline.expired():
+                self._timedOut()
+            else:
+                # Log stuff here.
+                e = sys.exc_info()[0]
+                log.exception(e)
+        finally:
+            self.deadline.stop()
+
+    def _visit(self, url):
+        """Navigates to a url, within what is left of our budget. Remembers
+        the origins we end up on, so the pool can clear them after the scan.
+        """
+        if not hasattr(self.browser, "visitedOrigins"):
+            self.browser.visitedOrigins = set()
+        self.browser.visitedOrigins.add(originOf(url))
+        self.browser.driver.set_page_load_timeout(
+            max(1, math.ceil(self.deadline.remaining()))
+        )
+        self.browser.visit(url)
+        # Where redirects took us.
+        self.browser.visitedOrigins.add(originOf(self.browser.url))
+
+    def _findReusable(self):
+        """Finds the last finished run of our url, if it had the same notice.
+
+        Returns:
+            dict: The run, with its _id and settings, or None.
+        """
+        last = self.db.get_last_run_for_url(
+            self.url,
+            {"notice.contentHash": 1, "settings": 1},
+            status="runDone",
+        )
+        for run in last or []:
+            notice = run.get("notice") or {}
+            if notice.get("contentHash") == self.consent.contentHash and run.get(
+                "settings"
+            ):
+                return run
+        return None
+
+    def _screenElem(self, elem):
+        """Screenshots a element, written in the background.
+
+        Returns:
+            str: The path of the screenshot.
+        """
+        return getArtifactStore().putScreen(elem.screenshot_as_png)
+
+    def _screenSettingsFallback(self):
+        """Screenshots the settings when we could not find their element.
+        Clips to the most likely settings region, or the viewport, unless
+        full page captures are asked for.
+        """
+        if self.capture["mode"] == "full":
+            self.conset.scrn = self._screenFullPage()
+            self.conset.captureMode = "full"
+            return
+        driver = self.browser.driver
+        # Regions are measured in the top document, as CDP captures it.
+        driver.switch_to.default_content()
+        rect = driver.execute_script(FIND_REGION_JS, SETTINGS_CANDIDATES)
+        mode = "clip"
+        if not rect:
+            rect = driver.execute_script(
+                "return {x: window.scrollX, y: window.scrollY, "
+                "width: window.innerWidth, height: window.innerHeight};"
+            )
+            mode = "viewport"
+        png = captureClip(
+            driver,
+            rect,
+            margin=20 if mode == "clip" else 0,
+            maxSize=self.capture["maxSize"],
+            scale=self.capture["scale"],
+        )
+        self.conset.scrn = getArtifactStore().putScreen(png)
+        self.conset.captureMode = mode
+
+    def _screenFullPage(self):
+        """Screenshots the whole page, written in the background.
+
+        Returns:
+            str: The path of the screenshot.
+        """
+        driver = self.browser.driver
+        size = driver.get_window_size()
+        self.browser.full_screen()
+        try:
+            png = driver.get_screenshot_as_png()
+        finally:
+            self.browser.recover_screen(size)
+        return getArtifactStore().putScreen(png)
+
+    def _timedOut(self):
+        """Saves the run as timed out, with the stage it got to."""
+        log.warning("Run timed out in stage {}.", self.deadline.stage)
+        self.endedAt = datetime.utcnow()
+        self.db.modify_run(
+            self.runId,
+            {
+                "status": "timedOut",
+                "stage": self.deadline.stage,
+                "browserSize": self.windowSize,
+                "crawlMode": self.crawlMode,
+                "startedAt": self.startedAt,
+                "endedAt": self.endedAt,
+                "lang": self.lang,
+                "langSource": self.langSource,
+                "scrn": self.scrn,
+                "startCookies": self.startCookies,
+                "endCookies": self.endCookies,
+                "waits": self.waits,
+                "detection": self.detection,
+            },
+        )
+
+    def _wait(self, stage, selector=None):
+        """Waits for the page to settle and records how long it took.
+
+        Args:
+            stage (str): The name of the wait, for the run document.
+            selector (str, optional): Stop early when a new element matching this appears.
+        """
+        timeout = min(5, max(0, self.deadline.remaining()))
+        wait = waitForQuiet(self.browser, timeout=timeout, selector=selector)
+        wait["stage"] = stage
+        log.debug("Waited {waited}s for {stage} ({reason}).", **wait)
+        self.waits.append(wait)
 
     @log.catch
     def _iframeHandler(self):  # TODO: Cleamup handler, make iframe agnostic.
@@ -788,13 +1834,25 @@ class PageScanner:
 
     @log.catch
     def _resolveLang(self):
-        """Tries to resolve language of current page."""
+        """Tries to resolve language of current page. Uses what the page says
+        it is in, if anything, else detects it from a sample of its text.
+        Detected languages are cached per host, the page is asked every time.
+        """
+        host = urlsplit(self.url if "//" in self.url else "//" + self.url).hostname
         try:
             log.debug("Determining language.")
-            textBody = self.browser.evaluate_script(
-                "window.document.body.innerText.valueOf();"
+            signals = self.browser.driver.execute_script(
+                LANG_SIGNALS_JS, LANG_SAMPLE_CHARS
             )
-            self.lang = detect(textBody)
+            if signals["lang"]:
+                self.lang = signals["lang"].split("-")[0].lower()
+                self.langSource = signals["source"]
+            elif host in langCache:
+                self.lang, self.langSource = langCache[host], "cache"
+            else:
+                self.lang = detect(signals["text"])
+                self.langSource = "text"
+                langCache[host] = self.lang
         except:
             log.debug("Could not determine language.")
 
@@ -815,11 +1873,63 @@ class PageScanner:
         )
 
 
-def setupDriver(hless=False):
+# Extensions of the heavy resources blocked in fast mode. Scripts, styles
+# and iframes are left alone, so consent platforms still load.
+FAST_BLOCKED_EXTENSIONS = [
+    "png",
+    "jpg",
+    "jpeg",
+    "gif",
+    "webp",
+    "avif",
+    "ico",
+    "woff",
+    "woff2",
+    "ttf",
+    "otf",
+    "eot",
+    "mp4",
+    "webm",
+    "m3u8",
+    "mp3",
+    "ogg",
+    "wav",
+]
+# Blocked url patterns match the whole url, so also match the extension with a
+# query string after it.
+FAST_BLOCKED_URLS = [
+    pattern
+    for ext in FAST_BLOCKED_EXTENSIONS
+    for pattern in ("*." + ext, "*." + ext + "?*")
+]
+# Ad and analytics hosts, optionally blocked in fast mode. Tag managers are
+# not in here as they often load the consent platform.
+TRACKER_BLOCKED_URLS = [
+    "*google-analytics.com*",
+    "*doubleclick.net*",
+    "*googlesyndication.com*",
+    "*adservice.google.*",
+    "*amazon-adsystem.com*",
+    "*adnxs.com*",
+    "*criteo.com*",
+    "*criteo.net*",
+    "*taboola.com*",
+    "*outbrain.com*",
+    "*scorecardresearch.com*",
+    "*quantserve.com*",
+    "*hotjar.com*",
+    "*connect.facebook.net*",
+]
+
+
+def setupDriver(hless=False, pageLoadStrategy="eager", fast=False, blockTrackers=False):
     """Returns a setup browser from splinter, ready for scaping.
 
     Args:
         hless (bool, optional): Should the browser run headless. Defaults to False.
+        pageLoadStrategy (str, optional): "eager" returns from navigation once the DOM is ready, "normal" waits for all resources. Defaults to "eager".
+        fast (bool, optional): Block images, media and fonts, for detection only crawls. Defaults to False.
+        blockTrackers (bool, optional): In fast mode, also block ad/analytics hosts. Defaults to False.
 
     Returns:
         WebDriver: A splinter browser driver.
@@ -827,36 +1937,574 @@ def setupDriver(hless=False):
     browserOptions = wd.ChromeOptions()
     browserOptions.add_argument("--lang=en-GB")
     browserOptions.add_argument("--window-size=1920,1080")
-    browserOptions.add_experimental_option(
-        "prefs", {"intl.accept_languages": "en,en_GB"}
-    )
+    prefs = {"intl.accept_languages": "en,en_GB"}
+    if fast:
+        prefs["profile.managed_default_content_settings.images"] = 2
+    browserOptions.add_experimental_option("prefs", prefs)
     browserOptions.add_experimental_option("w3c", False)
     browserOptions.headless = hless
+    browserOptions.set_capability("pageLoadStrategy", pageLoadStrategy)
     if hless:
         log.info("Starting a headless chrome drier...")
     else:
         log.info("Starting a visible chrome driver...")
-    return Sbrowser("chrome", options=browserOptions)
+    browser = Sbrowser("chrome", options=browserOptions)
+    # Allow the in page waits to run for their whole time.
+    browser.driver.set_script_timeout(30)
+    # Remember the mode, so it can be saved with every run. Images are off by
+    # the pref in fast mode, the rest only once the url patterns are blocked.
+    browser.crawlMode = {
+        "fast": fast,
+        "blockTrackers": False,
+        "imagesOff": fast,
+        "blockedUrls": 0,
+    }
+    if fast:
+        blocked = FAST_BLOCKED_URLS + (TRACKER_BLOCKED_URLS if blockTrackers else [])
+        try:
+            browser.driver.execute_cdp_cmd("Network.enable", {})
+            browser.driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": blocked})
+            log.info("Fast mode, blocking {} url patterns.", len(blocked))
+            browser.crawlMode["blockedUrls"] = len(blocked)
+            browser.crawlMode["blockTrackers"] = blockTrackers
+        except Exception as e:
+            log.warning("Could not block resources, only images are off: {}", e)
+    # Pin the generic adblock rules to the session, once.
+    install_generic_rules(browser)
+    return browser
+
+
+# The url of the top document, and of every frame it loaded, also the ones
+# that are gone or cross origin.
+FRAME_URLS_JS = """
+    const urls = [window.location.href];
+    for (const frame of document.querySelectorAll("iframe[src], frame[src]")) {
+        urls.push(frame.src);
+    }
+    for (const entry of performance.getEntriesByType("resource")) {
+        if (entry.initiatorType === "iframe" || entry.initiatorType === "frame") {
+            urls.push(entry.name);
+        }
+    }
+    return urls;
+"""
 
 
-if __name__ == "__main__":
-    Logger(log)
-    db = DatabaseManager()
+def originOf(url):
+    """Gets the origin of a url, like https://example.com.
+
+    Args:
+        url (str): The url.
+
+    Returns:
+        str: The origin, or None for urls without one, like about:blank.
+    """
+    parts = urlsplit(url or "")
+    if parts.scheme not in ("http", "https") or not parts.netloc:
+        return None
+    return "{}://{}".format(parts.scheme, parts.netloc)
+
+
+class BrowserPool:
+    """A pool of warmed up browsers, which are reset and reused between sites
+    instead of starting a new Chrome for every url.
+    """
+
+    def __init__(self, size=1, maxPages=50, hless=True, **driverOptions):
+        """Init class for BrowserPool
+
+        Args:
+            size (int, optional): The amount of browsers to keep warm. Defaults to 1.
+            maxPages (int, optional): Recycle a browser after this many pages. Defaults to 50.
+            hless (bool, optional): Should the browsers run headless. Defaults to True.
+            driverOptions: Other arguments for setupDriver.
+        """
+        self.size = size
+        self.maxPages = maxPages
+        self.hless = hless
+        self.driverOptions = driverOptions
+        self.idle = queue.Queue()
+        self.pages = {}  # Pages served, by browser session id.
+        for _ in range(size):
+            self.idle.put(self._start())
+
+    def _start(self):
+        browser = setupDriver(self.hless, **self.driverOptions)
+        self.pages[browser.driver.session_id] = 0
+        return browser
+
+    def _stop(self, browser):
+        self.pages.pop(browser.driver.session_id, None)
+        try:
+            browser.quit()
+        except Exception as e:
+            # The session might have been killed by a watchdog.
+            log.debug("Could not quit browser: {}", e)
+
+    def acquire(self):
+        """Takes a browser from the pool, waits for one if all are busy.
+
+        Returns:
+            WebDriver: A splinter browser driver.
+        """
+        return self.idle.get()
+
+    def release(self, browser):
+        """Gives a browser back to the pool, resetting or recycling it.
+
+        Args:
+            browser (WebDriver): The browser to give back.
+        """
+        session_id = browser.driver.session_id
+        self.pages[session_id] = self.pages.get(session_id, 0) + 1
+        if self.pages[session_id] >= self.maxPages:
+            log.debug("Recycling browser after {} pages.", self.pages[session_id])
+        elif self.reset(browser):
+            self.idle.put(browser)
+            return
+        self._stop(browser)
+        self.idle.put(self._start())
+
+    @contextmanager
+    def browser(self):
+        """Context manager that acquires and releases a browser."""
+        browser = self.acquire()
+        try:
+            yield browser
+        finally:
+            self.release(browser)
+
+    @staticmethod
+    def reset(browser):
+        """Clears all state a site left behind in a browser.
+
+        Args:
+            browser (WebDriver): The browser to reset.
+
+        Returns:
+            boolean: If the browser could be reset.
+        """
+        try:
+            driver = browser.driver
+            driver.switch_to.default_content()
+            # Close all extra tabs/windows.
+            handles = driver.window_handles
+            for handle in handles[1:]:
+                driver.switch_to.window(handle)
+                driver.close()
+            driver.switch_to.window(handles[0])
+            # Clear storage, service workers and caches of every origin the
+            # site used: the ones we navigated to, and those of its frames,
+            # like the consent domains of CMPs.
+            origins = set(getattr(browser, "visitedOrigins", ()))
+            for url in driver.execute_script(FRAME_URLS_JS) or []:
+                origins.add(originOf(url))
+            origins.discard(None)
+            for origin in origins:
+                driver.execute_cdp_cmd(
+                    "Storage.clearDataForOrigin",
+                    {"origin": origin, "storageTypes": "all"},
+                )
+            browser.visitedOrigins = set()
+            driver.execute_cdp_cmd("Network.clearBrowserCookies", {})
+            driver.execute_cdp_cmd("Network.clearBrowserCache", {})
+            driver.get("about:blank")
+            return True
+        except Exception as e:
+            log.warning("Could not reset browser: {}", e)
+            return False
+
+    def close(self):
+        """Quits all the idle browsers in the pool."""
+        while not self.idle.empty():
+            self._stop(self.idle.get())
+
+
+def readUrlList(path="url_list.csv", limit=5000):
+    """Reads the urls to crawl from a csv file of domains.
+
+    Args:
+        path (str, optional): Path to the csv file. Defaults to "url_list.csv".
+        limit (int, optional): The max amount of urls to read. Defaults to 5000.
+
+    Returns:
+        [list]: The urls, in the order of the file.
+    """
     url_list = []
-    with open("url_list.csv", "r") as link_csv_file:
+    with open(path, "r") as link_csv_file:
         csv_reader = csv.DictReader(link_csv_file)
 
         header = next(csv_reader)
         if header != None:
-            for link in islice(csv_reader, 5000):
+            for link in islice(csv_reader, limit):
                 http_string = "https://" + link["Domain"]
                 url_list.append(http_string)
+    return url_list
 
-    for url in url_list:
-        runId += 1
-        print("Creating test obj..")
-        browser = setupDriver(True)
-        with log.contextualize(url=url):
-            res = PageScanner(browser, db, url)
-            res.doScan()
-            browser.quit()
+
+def claimUrls(db: DatabaseManager, owner=None, stop=None, lease=120):
+    """Yields urls claimed from the campaign queue in the database, keeping
+    the lease of each alive until the next one is asked for.
+
+    Args:
+        db (DatabaseManager): The database, with the campaign to crawl.
+        owner (str, optional): Id of this worker. Defaults to host and pid.
+        stop (Event, optional): When set, stop claiming urls.
+        lease (int, optional): Seconds a claim lasts without a heartbeat. Defaults to 120.
+    """
+    owner = owner or "{}-{}".format(socket.gethostname(), os.getpid())
+    while not (stop and stop.is_set()):
+        entry = db.claim_url(owner, lease)
+        if entry is None:
+            log.info("Queue is empty.")
+            break
+        done = threading.Event()
+
+        def beat():
+            while not done.wait(lease / 3):
+                if not db.heartbeat(entry["_id"], owner, lease):
+                    log.warning("Lost the lease on {}.", entry["url"])
+                    break
+
+        beater = threading.Thread(target=beat, name="lease-heartbeat", daemon=True)
+        beater.start()
+        state = "pending"  # Hand the url back if we never get to finish it.
+        try:
+            yield entry["url"]
+            state = "done"
+        finally:
+            done.set()
+            beater.join()
+            db.complete_url(entry["_id"], owner, state)
+
+
+# Second level suffixes that are registered under, like example.co.uk.
+SECOND_LEVEL_SUFFIXES = {"ac", "co", "com", "edu", "gov", "net", "org", "ne", "or"}
+
+
+def registrableDomain(url):
+    """Guesses the registrable domain of a url, e.g. example.co.uk for
+    https://www.example.co.uk. Good enough to group sites, without a public
+    suffix list.
+
+    Args:
+        url (str): The url.
+
+    Returns:
+        str: The registrable domain.
+    """
+    host = urlsplit(url if "//" in url else "//" + url).hostname or url
+    labels = host.split(".")
+    keep = 3 if len(labels) > 2 and labels[-2] in SECOND_LEVEL_SUFFIXES else 2
+    return ".".join(labels[-keep:])
+
+
+def scheduleUrls(urls, durations, workers=1):
+    """Orders urls so the slowest start first, which keeps the workers busy
+    until the end of the crawl. Urls without a known duration follow, in
+    their original order. Urls on the same registrable domain are kept at
+    least workers apart, so they are not crawled at the same time.
+
+    Args:
+        urls (list): The urls, in rank order.
+        durations (dict): Expected seconds per url, see DatabaseManager.get_run_durations.
+        workers (int, optional): The amount of parallel workers. Defaults to 1.
+
+    Returns:
+        list: The urls, in crawl order.
+    """
+    known = sorted(
+        (url for url in urls if url in durations), key=lambda url: -durations[url]
+    )
+    unseen = [url for url in urls if url not in durations]
+    waiting = deque(known + unseen)
+    recent = deque(maxlen=max(workers - 1, 0))
+    ordered = []
+    while waiting:
+        # Take the first url whose domain is not being crawled right now,
+        # looking a bit ahead only, to keep this linear.
+        for i, url in enumerate(islice(waiting, 4 * workers)):
+            if registrableDomain(url) not in recent:
+                break
+        else:
+            i = 0
+        url = waiting[i]
+        del waiting[i]
+        ordered.append(url)
+        recent.append(registrableDomain(url))
+    log.info("Scheduled {} urls, {} with a known duration.", len(ordered), len(known))
+    return ordered
+
+
+def crawl(urls, db: DatabaseManager, pool: BrowserPool, stop=None, scanOptions=None):
+    """Scans urls one at a time, with browsers from a pool.
+
+    Args:
+        urls (iterable): The urls to scan.
+        db (DatabaseManager): Where to save the runs.
+        pool (BrowserPool): Where to get browsers from.
+        stop (Event, optional): When set, stop before the next url.
+        scanOptions (dict, optional): Arguments for PageScanner.doScan.
+    """
+    memo = {"hit": 0, "miss": 0}
+    for url in urls:
+        if stop and stop.is_set():
+            log.info("Stopping crawl.")
+            break
+        with pool.browser() as browser:
+            with log.contextualize(url=url):
+                res = PageScanner(browser, db, url)
+                res.doScan(**(scanOptions or {}))
+        if res.detection and res.detection["memo"]:
+            memo[res.detection["memo"]] += 1
+    if memo["hit"] or memo["miss"]:
+        log.info(
+            "Detection memo: {} hits, {} misses ({:.0%} hit rate).",
+            memo["hit"],
+            memo["miss"],
+            memo["hit"] / (memo["hit"] + memo["miss"]),
+        )
+
+
+def crawlWorker(
+    workerId, urls, stop, dbOptions=None, poolOptions=None, scanOptions=None
+):
+    """The main function of a crawl worker process. Pulls urls from the
+    shared queue until it gets None or is told to stop.
+
+    Args:
+        workerId (int): The number of the worker, used in logs.
+        urls (Queue): The shared queue of urls, or None to claim them from the database queue.
+        stop (Event): When set, stop before the next url.
+        dbOptions (dict, optional): Arguments for the DatabaseManager.
+        poolOptions (dict, optional): Arguments for the BrowserPool.
+        scanOptions (dict, optional): Arguments for PageScanner.doScan.
+    """
+    # Leave ctrl-c to the main process, it tells us to stop through the event.
+    # A session of our own keeps the terminal's ctrl-c from reaching the
+    # chromedriver and browser we start, too.
+    os.setsid()
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, lambda signum, frame: stop.set())
+    with log.contextualize(worker="worker-{}".format(workerId)):
+        log.info("Worker started.")
+        db = DatabaseManager(**(dbOptions or {}))
+        pool = BrowserPool(**(poolOptions or {}))
+        try:
+            if urls is None:
+                urls = claimUrls(db, stop=stop)
+            else:
+                urls = iter(urls.get, None)
+            crawl(urls, db, pool, stop, scanOptions)
+        finally:
+            pool.close()
+            closeArtifactStore()
+            db.close()
+        log.info("Worker done.")
+
+
+def crawlParallel(urls, workers, dbOptions=None, poolOptions=None, scanOptions=None):
+    """Scans urls with several worker processes, each with its own browser,
+    pulling from a shared queue.
+
+    Args:
+        urls (list): The urls to scan, or None to claim them from the database queue.
+        workers (int): The amount of worker processes.
+        dbOptions (dict, optional): Arguments for the DatabaseManager.
+        poolOptions (dict, optional): Arguments for each workers BrowserPool.
+        scanOptions (dict, optional): Arguments for PageScanner.doScan.
+    """
+    # Fork, so the workers share the enqueued log sinks.
+    ctx = multiprocessing.get_context("fork")
+    stop = ctx.Event()
+    urlQueue = None
+    if urls is not None:
+        urlQueue = ctx.Queue()
+        for url in urls:
+            urlQueue.put(url)
+        for _ in range(workers):
+            urlQueue.put(None)  # One stop marker per worker.
+    procs = [
+        ctx.Process(
+            target=crawlWorker,
+            args=(i, urlQueue, stop, dbOptions, poolOptions, scanOptions),
+            name="crawler-{}".format(i),
+        )
+        for i in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    if urls is None:
+        log.info("Started {} workers on the database queue.", workers)
+    else:
+        log.info("Started {} workers for {} urls.", workers, len(urls))
+    try:
+        for proc in procs:
+            proc.join()
+    except KeyboardInterrupt:
+        log.info("Stopping workers after their current url...")
+        stop.set()
+        for proc in procs:
+            proc.join()
+    if urlQueue is not None:
+        # Urls left after a stop would keep the feeder thread flushing to a
+        # pipe nobody reads, and hang us at exit.
+        urlQueue.cancel_join_thread()
+        urlQueue.close()
+    log.info("All workers done.")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="A GDPR/Cookie consent crawler.")
+    parser.add_argument(
+        "--workers", type=int, default=1, help="Amount of crawler processes."
+    )
+    parser.add_argument(
+        "--limit", type=int, default=5000, help="Amount of urls to crawl."
+    )
+    parser.add_argument(
+        "--budget", type=int, default=90, help="Max seconds to spend on one url."
+    )
+    parser.add_argument(
+        "--page-load",
+        choices=["eager", "normal"],
+        default="eager",
+        help="When navigation is considered done.",
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="Block images, media and fonts, for detection only crawls.",
+    )
+    parser.add_argument(
+        "--block-trackers",
+        action="store_true",
+        help="With --fast, also block known ad/analytics hosts.",
+    )
+    parser.add_argument(
+        "--screen-format",
+        choices=list(ArtifactStore.FORMATS),
+        default="png",
+        help="How to encode screenshots.",
+    )
+    parser.add_argument(
+        "--artifact-root",
+        default=None,
+        help="Where to store screenshots and HTML, e.g. a share all machines mount. Defaults to result/artifacts.",
+    )
+    parser.add_argument(
+        "--screen-quality",
+        type=int,
+        default=80,
+        help="Quality of webp/jpeg screenshots.",
+    )
+    parser.add_argument(
+        "--campaign",
+        default=pendulum.now().format("YYYY-MM"),
+        help="Id of the crawl campaign, urls already done in it are skipped. Defaults to the current month.",
+    )
+    parser.add_argument(
+        "--fresh-days",
+        type=float,
+        default=0,
+        help="Also skip urls with a finished run from the last this many days, in any campaign.",
+    )
+    parser.add_argument(
+        "--distributed",
+        action="store_true",
+        help="Queue the campaign in the database, and claim urls from there, so several machines can crawl it.",
+    )
+    parser.add_argument(
+        "--schedule",
+        choices=["cost", "rank"],
+        default="cost",
+        help="Crawl the urls that took longest in earlier runs first, or in list order.",
+    )
+    parser.add_argument(
+        "--no-memo",
+        action="store_true",
+        help="Always run the full detection, instead of first looking where the notice was last crawl.",
+    )
+    parser.add_argument(
+        "--force-full",
+        action="store_true",
+        help="Go through the settings of every notice, also the ones unchanged since last crawl.",
+    )
+    parser.add_argument(
+        "--capture",
+        choices=["clip", "full"],
+        default="clip",
+        help="Screenshot the likely settings region or the full page, when no settings element is found.",
+    )
+    parser.add_argument(
+        "--capture-scale",
+        type=float,
+        default=1.0,
+        help="Downscale factor for clipped captures.",
+    )
+    args = parser.parse_args()
+    Logger(log)
+    url_list = readUrlList("url_list.csv", args.limit)
+    artifactOptions.update(
+        root=args.artifact_root, fmt=args.screen_format, quality=args.screen_quality
+    )
+    poolOptions = {
+        "size": 1,
+        "maxPages": 50,
+        "hless": True,
+        "pageLoadStrategy": args.page_load,
+        "fast": args.fast,
+        "blockTrackers": args.block_trackers,
+    }
+    scanOptions = {
+        "useMemo": not args.no_memo,
+        "forceFull": args.force_full,
+        "budget": args.budget,
+        "capture": args.capture,
+        "captureScale": args.capture_scale,
+    }
+    dbOptions = {"campaign": args.campaign}
+    db = DatabaseManager(**dbOptions)
+    freshFor = timedelta(days=args.fresh_days) if args.fresh_days else None
+    # A run can not take much longer than its budget.
+    url_list = db.plan_campaign(url_list, freshFor, timedelta(seconds=2 * args.budget))
+    if args.schedule == "cost":
+        durations = db.get_run_durations(url_list)
+        url_list = scheduleUrls(url_list, durations, args.workers)
+    if args.distributed:
+        added = db.enqueue_urls(url_list)
+        log.info("Queued {} new urls for campaign {}.", added, args.campaign)
+        url_list = None
+    if args.workers > 1:
+        # The workers connect on their own, after the fork.
+        db.close()
+        crawlParallel(
+            url_list,
+            args.workers,
+            dbOptions=dbOptions,
+            poolOptions=poolOptions,
+            scanOptions=scanOptions,
+        )
+    else:
+        pool = BrowserPool(**poolOptions)
+        try:
+            if url_list is None:
+                url_list = claimUrls(db)
+            crawl(url_list, db, pool, scanOptions=scanOptions)
+        finally:
+            pool.close()
+            closeArtifactStore()
+            db.close()
+    # The crawl closed its connection, open one to report on the campaign.
+    db = DatabaseManager(**dbOptions)
+    try:
+        memo = db.get_memo_stats()
+        log.info(
+            "Campaign {} detection memo: {} hits, {} misses, {} without memo.",
+            args.campaign,
+            memo.get("hit", 0),
+            memo.get("miss", 0),
+            memo.get(None, 0),
+        )
+    finally:
+        db.close()
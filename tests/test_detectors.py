@@ -0,0 +1,126 @@
+import detectors
+
+
+class StubBrowser:
+    """Answers the button candidate script with fixed buttons, and the
+    button parent script with a marker for the button it was given.
+    """
+
+    def __init__(self, texts):
+        self.buttons = [("button-{}".format(i), text) for i, text in enumerate(texts)]
+        self.parentCalls = []
+
+    def execute_script(self, script, *args):
+        if script == detectors.BUTTON_CANDIDATES_JS:
+            return [list(button) for button in self.buttons]
+        assert "findBtnParent(arguments[0])" in script
+        self.parentCalls.append(args[0])
+        return "parent-of-" + args[0]
+
+    def find_by_xpath(self, xpath):
+        return []
+
+
+def test_find_by_btn_parent_returns_parent_of_approve_button():
+    browser = StubBrowser(["read more", "accept"])
+    assert detectors.find_by_btn_parent(browser) == "parent-of-button-1"
+    assert browser.parentCalls == ["button-1"]
+
+
+def test_find_settings_returns_parent_of_save_button():
+    browser = StubBrowser(["deny", "save"])
+    assert detectors.find_settings(browser) == "parent-of-button-1"
+
+
+def test_btn_parent_finders_without_buttons():
+    browser = StubBrowser(["nothing here"])
+    assert detectors.find_by_btn_parent(browser) is None
+    assert detectors.find_settings(browser) is None
+    assert browser.parentCalls == []
+
+
+class StubElement:
+    def __init__(self, isNotice):
+        self.isNotice = isNotice
+        self.parent = self
+        self.tag_name = "DIV"
+
+    def is_displayed(self):
+        return True
+
+    def execute_script(self, script, *args):
+        if script == detectors.MEMO_CHECK_JS:
+            return self.isNotice
+        return "#notice"
+
+
+class StubDriver:
+    def __init__(self, elem):
+        self.elem = elem
+
+    def find_elements_by_css_selector(self, selector):
+        return [self.elem]
+
+
+class StubMemoBrowser:
+    def __init__(self, elem):
+        self.driver = StubDriver(elem)
+
+
+MEMO = {"selector": "body > div:nth-of-type(2)", "strategy": "fixedParent"}
+
+
+def test_memo_hit_is_used_when_it_still_is_the_notice(monkeypatch):
+    monkeypatch.setattr(detectors, "_detect_by_cascade", None)
+    elem = StubElement(isNotice=True)
+    result = detectors.detect_cookie_notice(StubMemoBrowser(elem), memo=MEMO)
+    assert result["memo"] == "hit"
+    assert result["elem"] is elem
+
+
+def test_memo_hit_on_other_element_runs_the_cascade(monkeypatch):
+    found = StubElement(isNotice=True)
+    monkeypatch.setattr(
+        detectors,
+        "_detect_by_cascade",
+        lambda browser, mode: {"elem": found, "strategy": "btnParent", "score": 1},
+    )
+    browser = StubMemoBrowser(StubElement(isNotice=False))
+    result = detectors.detect_cookie_notice(browser, memo=MEMO)
+    assert result["memo"] == "miss"
+    assert result["elem"] is found
+    assert result["strategy"] == "btnParent"
+
+
+class StubIndex:
+    generic = [".cookie-banner"]
+
+    def lookup(self, url):
+        return [], set()
+
+
+class StubBundleBrowser:
+    """Runs the bundle in a document that lacks the installed generic rules."""
+
+    url = "https://example.com/"
+
+    def __init__(self):
+        self.driver = StubDriver(None)
+        self.driver.session_id = "session"
+        self.sentGeneric = []
+
+    def execute_script(self, script, trigs, specific, excepted, generic):
+        assert script == detectors.DETECT_NOTICE_JS
+        self.sentGeneric.append(generic)
+        if generic is None:
+            return {"elem": None, "strategy": None, "score": 0, "rulesMissing": True}
+        return {"elem": "banner", "strategy": "adblockList", "score": 1}
+
+
+def test_bundle_sends_generic_rules_when_missing_in_document(monkeypatch):
+    monkeypatch.setattr(detectors, "get_rule_index", StubIndex)
+    monkeypatch.setattr(detectors, "_installed_sessions", {"session"})
+    browser = StubBundleBrowser()
+    result = detectors.detect_by_bundle(browser)
+    assert browser.sentGeneric == [None, StubIndex.generic]
+    assert result == {"elem": "banner", "strategy": "adblockList", "score": 1}
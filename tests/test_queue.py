@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+import uuid
+
+import pytest
+from pymongo import MongoClient
+
+from main import DatabaseManager
+
+# The queue needs a real mongod, 4.2 or newer for the server side leases.
+DB_URL = os.environ.get("CCRAWLER_TEST_DB", "mongodb://localhost:27017")
+
+
+def serverVersion():
+    try:
+        client = MongoClient(DB_URL, serverSelectionTimeoutMS=500)
+        return tuple(client.server_info()["versionArray"][:2])
+    except Exception:
+        return None
+
+
+version = serverVersion()
+pytestmark = pytest.mark.skipif(
+    version is None or version < (4, 2),
+    reason="needs MongoDB 4.2 or newer at {}".format(DB_URL),
+)
+
+
+@pytest.fixture
+def campaign():
+    """A campaign of its own for each test, its queue is removed after."""
+    name = "test-{}".format(uuid.uuid4().hex)
+    yield name
+    client = MongoClient(DB_URL)
+    client["ccrawler"]["queue"].delete_many({"campaign": name})
+    client.close()
+
+
+@pytest.fixture
+def workers(campaign):
+    """DatabaseManagers for the campaign, one per worker, as on several machines."""
+    made = []
+
+    def make(count):
+        made.extend(DatabaseManager(DB_URL, campaign=campaign) for _ in range(count))
+        return made[-count:]
+
+    yield make
+    for db in made:
+        db.close()
+
+
+def test_workers_claim_every_url_once(workers):
+    dbs = workers(4)
+    urls = ["site{}.example".format(i) for i in range(40)]
+    assert dbs[0].enqueue_urls(urls) == len(urls)
+    assert dbs[1].enqueue_urls(urls) == 0
+    claimed = []
+
+    def work(db, owner):
+        while True:
+            entry = db.claim_url(owner)
+            if entry is None:
+                return
+            claimed.append(entry["url"])
+            assert db.heartbeat(entry["_id"], owner)
+            assert db.complete_url(entry["_id"], owner)
+
+    threads = [
+        threading.Thread(target=work, args=(db, "worker-{}".format(i)))
+        for i, db in enumerate(dbs)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(claimed) == sorted(urls)
+    states = dbs[0].queue.distinct("state", {"campaign": dbs[0].campaign})
+    assert states == ["done"]
+
+
+def test_claims_go_by_rank(workers):
+    (db,) = workers(1)
+    db.enqueue_urls(["first.example", "second.example"])
+    assert db.claim_url("worker")["url"] == "first.example"
+    assert db.claim_url("worker")["url"] == "second.example"
+    assert db.claim_url("worker") is None
+
+
+def test_only_the_owner_renews_and_completes(workers):
+    (db,) = workers(1)
+    db.enqueue_urls(["site.example"])
+    entry = db.claim_url("owner")
+    assert not db.heartbeat(entry["_id"], "other")
+    assert not db.complete_url(entry["_id"], "other")
+    assert db.heartbeat(entry["_id"], "owner")
+    assert db.complete_url(entry["_id"], "owner", state="pending")
+    # Handed back, so it can be claimed again.
+    assert db.claim_url("other")["attempts"] == 2
+
+
+def test_expired_lease_is_claimed_again(workers):
+    gone, alive = workers(2)
+    gone.enqueue_urls(["site.example"])
+    entry = gone.claim_url("gone", lease=1)
+    assert alive.claim_url("alive") is None
+    time.sleep(1.5)
+    again = alive.claim_url("alive")
+    assert again["_id"] == entry["_id"]
+    assert again["attempts"] == 2
+    # The first worker lost the url.
+    assert not gone.heartbeat(entry["_id"], "gone")
+    assert not gone.complete_url(entry["_id"], "gone")
+    assert alive.complete_url(again["_id"], "alive")
+
+
+def test_url_is_given_up_after_max_attempts(workers):
+    (db,) = workers(1)
+    db.enqueue_urls(["site.example"])
+    for attempt in range(2):
+        entry = db.claim_url("worker", max_attempts=2)
+        assert db.complete_url(entry["_id"], "worker", state="pending")
+    assert db.claim_url("worker", max_attempts=2) is None
@@ -0,0 +1,129 @@
+import os
+
+import detectors
+from detectors import RuleIndex, domain_suffixes
+
+FILTERLIST = [
+    "[Adblock Plus 2.0]",
+    "! Checksum: abc123",
+    "! Title: Test list",
+    "##.cookie-banner",
+    "###privacyBar",
+    "##.privacyBar",
+    "example.com##.example-notice",
+    "shop.example.com,other.org##.shop-notice",
+    "~example.com##.not-on-example",
+    "example.com#@#.privacyBar",
+    "&accept_cookies=",
+]
+
+
+def test_domain_suffixes():
+    assert domain_suffixes("https://www.example.com/path?q=1") == [
+        "www.example.com",
+        "example.com",
+        "com",
+    ]
+    assert domain_suffixes("example.com") == ["example.com", "com"]
+    assert domain_suffixes("HTTP://Example.COM:8080") == ["example.com", "com"]
+    assert domain_suffixes("") == []
+
+
+def test_from_filterlist_splits_generic_and_specific_rules():
+    index = RuleIndex.from_filterlist(FILTERLIST)
+    assert index.checksum == "abc123"
+    # Url blocking rules are not element hiding rules, they are left out.
+    assert index.generic == [
+        ".cookie-banner",
+        "#privacyBar",
+        ".privacyBar",
+        ".not-on-example",
+    ]
+    assert index.specific == {
+        "example.com": [".example-notice"],
+        "shop.example.com": [".shop-notice"],
+        "other.org": [".shop-notice"],
+    }
+
+
+def test_exceptions_and_exclusions_apply_to_subdomains():
+    index = RuleIndex.from_filterlist(FILTERLIST)
+    specific, excepted = index.lookup("https://www.example.com/")
+    assert specific == [".example-notice"]
+    # From the #@# rule and the ~example.com option.
+    assert excepted == {".privacyBar", ".not-on-example"}
+    assert index.rules_for_url("www.example.com") == [
+        ".cookie-banner",
+        "#privacyBar",
+        ".example-notice",
+    ]
+
+
+def test_lookup_collects_rules_of_every_suffix():
+    index = RuleIndex.from_filterlist(FILTERLIST)
+    specific, excepted = index.lookup("https://shop.example.com/")
+    assert specific == [".shop-notice", ".example-notice"]
+    assert index.lookup("https://example.org/") == ([], set())
+    assert index.rules_for_url("other.org") == [
+        ".cookie-banner",
+        "#privacyBar",
+        ".privacyBar",
+        ".not-on-example",
+        ".shop-notice",
+    ]
+
+
+def test_lookup_does_not_match_on_substrings():
+    index = RuleIndex.from_filterlist(FILTERLIST)
+    assert index.lookup("https://notexample.com/") == ([], set())
+
+
+def countBuilds(monkeypatch):
+    builds = []
+    fromFile = RuleIndex.from_file.__func__
+
+    def counting(cls, path):
+        builds.append(path)
+        return fromFile(cls, path)
+
+    monkeypatch.setattr(RuleIndex, "from_file", classmethod(counting))
+    return builds
+
+
+def test_load_reuses_the_cache_until_the_list_changes(tmp_path, monkeypatch):
+    path = tmp_path / "list.txt"
+    path.write_text("\n".join(FILTERLIST) + "\n")
+    builds = countBuilds(monkeypatch)
+    first = RuleIndex.load(str(path))
+    assert os.path.exists(str(path) + ".cache")
+    cached = RuleIndex.load(str(path))
+    assert len(builds) == 1
+    assert cached.__dict__ == first.__dict__
+
+    # A new checksum makes the cache stale, even if the mtime is the same.
+    stat = os.stat(path)
+    path.write_text(
+        "\n".join(FILTERLIST).replace("abc123", "def456") + "\n##.new-rule\n"
+    )
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    changed = RuleIndex.load(str(path))
+    assert len(builds) == 2
+    assert changed.checksum == "def456"
+    assert ".new-rule" in changed.generic
+
+    # So does a new mtime, for lists without a checksum.
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1))
+    RuleIndex.load(str(path))
+    assert len(builds) == 3
+
+
+def test_load_rebuilds_for_another_cache_version(tmp_path, monkeypatch):
+    path = tmp_path / "list.txt"
+    path.write_text("\n".join(FILTERLIST) + "\n")
+    builds = countBuilds(monkeypatch)
+    RuleIndex.load(str(path))
+    monkeypatch.setattr(
+        detectors, "RULE_CACHE_VERSION", detectors.RULE_CACHE_VERSION + 1
+    )
+    RuleIndex.load(str(path))
+    assert len(builds) == 2
@@ -0,0 +1,64 @@
+from main import registrableDomain, scheduleUrls
+
+
+def test_registrable_domain():
+    assert registrableDomain("https://www.example.com/path") == "example.com"
+    assert registrableDomain("en.wikipedia.org") == "wikipedia.org"
+    assert registrableDomain("https://shop.example.co.uk") == "example.co.uk"
+    assert registrableDomain("example.com") == "example.com"
+    assert registrableDomain("localhost") == "localhost"
+
+
+def test_slowest_urls_go_first():
+    durations = {"a.com": 10, "b.com": 30, "c.com": 20}
+    assert scheduleUrls(["a.com", "b.com", "c.com"], durations) == [
+        "b.com",
+        "c.com",
+        "a.com",
+    ]
+
+
+def test_unseen_urls_follow_in_rank_order():
+    urls = ["x.com", "a.com", "y.com", "b.com", "z.com"]
+    durations = {"a.com": 5, "b.com": 10}
+    assert scheduleUrls(urls, durations) == [
+        "b.com",
+        "a.com",
+        "x.com",
+        "y.com",
+        "z.com",
+    ]
+
+
+def test_one_worker_keeps_same_domain_urls_together():
+    urls = ["a.example.com", "b.example.com", "other.org"]
+    assert scheduleUrls(urls, {}, workers=1) == urls
+
+
+def test_same_domain_urls_are_spaced_by_workers():
+    urls = [
+        "a.example.com",
+        "b.example.com",
+        "c.example.com",
+        "one.org",
+        "two.net",
+        "three.io",
+    ]
+    ordered = scheduleUrls(urls, {}, workers=3)
+    assert ordered == [
+        "a.example.com",
+        "one.org",
+        "two.net",
+        "b.example.com",
+        "three.io",
+        # Nothing else is left, so it can not wait any longer.
+        "c.example.com",
+    ]
+
+
+def test_spacing_keeps_the_slowest_first():
+    urls = ["a.blogspot.com", "b.blogspot.com", "c.org", "d.org", "e.net"]
+    durations = {"a.blogspot.com": 60, "b.blogspot.com": 50, "c.org": 40}
+    ordered = scheduleUrls(urls, durations, workers=2)
+    assert ordered == ["a.blogspot.com", "c.org", "b.blogspot.com", "d.org", "e.net"]
+    assert sorted(ordered) == sorted(urls)